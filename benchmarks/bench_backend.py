@@ -0,0 +1,61 @@
+"""Time the numpy and tensorflow backends of the coordinate functions over a range of point counts
+
+Run from the repository root with
+    python benchmarks/bench_backend.py
+and read off the point count where the tensorflow column drops below the numpy one.
+"""
+import argparse
+import timeit
+
+import numpy as np
+import tensorflow as tf
+
+from moretf import backend
+from moretf import validation
+from moretf import coordinate_transformation as ct
+
+POSE = (51.5, -0.12, 0.3, 51.501, -0.121, 1.2)
+
+def cases(points, rng):
+    coords = np.concatenate([rng.uniform(-50, 50, (points, 2)), np.ones((points, 1))], 1).astype(np.float32)
+    values = rng.uniform(0, 1, points).astype(np.float32)
+    shape = tf.constant([128, 128])
+    grid = ct.coordinates_2_tensor(tf.constant(coords), tf.constant(values), shape, 1.0)
+    coords = tf.constant(coords)
+    values = tf.constant(values)
+    return {
+        'normalise_homogenous': lambda: ct.normalise_homogenous(coords),
+        'latlon_transform_m_2d': lambda: ct.latlon_transform_m_2d(*POSE),
+        'local_2_global': lambda: ct.local_2_global(coords, *POSE),
+        'coordinates_2_tensor': lambda: ct.coordinates_2_tensor(coords, values, shape, 1.0),
+        'tensor_2_coordinates': lambda: ct.tensor_2_coordinates(grid, 1.0),
+    }
+
+def best_time(function, repeat):
+    function()
+    number = max(1, int(0.05/max(timeit.timeit(function, number=1), 1e-7)))
+    return min(timeit.repeat(function, number=number, repeat=repeat))/number
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--validation', choices=validation.LEVELS, default='off', help="validation level to time with")
+    args = parser.parse_args()
+    validation.set_validation_level(args.validation)
+
+    rng = np.random.default_rng(0)
+    print(f"{'function':<24}{'points':>10}{'tensorflow us':>16}{'numpy us':>12}  faster")
+    for points in args.points:
+        for name, function in cases(points, rng).items():
+            if name == 'latlon_transform_m_2d' and points != args.points[0]:
+                continue
+            times = {}
+            for name_backend in backend.BACKENDS:
+                with backend.using_backend(name_backend):
+                    times[name_backend] = best_time(function, args.repeat)*1e6
+            faster = min(times, key=times.get)
+            print(f"{name:<24}{points:>10}{times['tensorflow']:>16.1f}{times['numpy']:>12.1f}  {faster}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import importlib
+
+# Stand ins for heavy modules, so that importing moretf doesn't import tensorflow, numpy or haversine
+# until a function that needs them is called
+
+class LazyModule:
+    """Stand in for a module that is imported the first time one of its attributes is used
+    name: name of the module to import
+    namespace: globals of the module holding the stand in, which get the real module once it is imported
+    alias: name of the stand in in namespace
+    Replacing itself in namespace means only the first use pays for the indirection.
+    """
+    def __init__(self, name, namespace = None, alias = None):
+        self._name = name
+        self._namespace = namespace
+        self._alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        if self._namespace is not None and self._namespace.get(self._alias) is self:
+            self._namespace[self._alias] = module
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
+
+def lazy_import(name, namespace, alias):
+    """Make a stand in for a module that replaces itself in namespace when first used
+    name: name of the module to import
+    namespace: globals() of the importing module
+    alias: name the module is bound to there
+    """
+    return LazyModule(name, namespace, alias)
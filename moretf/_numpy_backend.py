@@ -0,0 +1,116 @@
+import math
+
+from moretf import validation
+from moretf._lazy import lazy_import
+
+np = lazy_import('numpy', globals(), 'np')
+
+import logging
+log = logging.getLogger(__name__)
+
+# NumPy versions of the small-batch functions in coordinate_transformation, used when the backend is 'numpy'
+# Arguments are checked by the public functions before they get here, and results match the tensorflow
+# versions in dtype and layout.
+
+# mean earth radius, as used by the haversine package
+_EARTH_RADIUS_M = 6371008.8
+
+def normalise_homogenous(x):
+    """Normalise an array of homogenous coordinates"""
+    x = np.asarray(x)
+    y = x/x[:,-1:]
+    if validation.should_validate('normalise_homogenous'):
+        assert(x.dtype == np.float32)
+        assert(x.ndim == 2)
+        assert(np.all(y[:,-1] == 1.0))
+    return y
+
+def latlon_transform_m_2d(o_lat, o_lon, o_head, n_lat, n_lon, n_head):
+    """Transform from coordinates centered on one pose to another, as a float32 (3,3) array"""
+    o_lat, o_lon, o_head, n_lat, n_lon, n_head = (float(v) for v in (o_lat, o_lon, o_head, n_lat, n_lon, n_head))
+    if validation.should_validate('latlon_transform_m_2d'):
+        if(o_head>2*math.pi or o_head<-2*math.pi):
+            log.error(f"o_head doesn't look like radians (value was {o_head})")
+        if(n_head>2*math.pi or n_head<-2*math.pi):
+            log.error(f"n_head doesn't look like radians (value was {n_head})")
+    an = math.radians(n_lat)
+    ae = math.radians(n_lon)
+    bn = math.radians(o_lat)
+    be = math.radians(o_lon)
+    d = math.sin((bn-an)*0.5)**2 + math.cos(an)*math.cos(bn)*math.sin((be-ae)*0.5)**2
+    crow_distance_ab = 2*_EARTH_RADIUS_M*math.asin(math.sqrt(d))
+    displacement_angle = math.atan2(
+        math.sin(be-ae)*math.cos(bn),
+        math.cos(an)*math.sin(bn)-math.sin(an)*math.cos(bn)*math.cos(be-ae)
+    )
+    # the same closed form as latlon_transform_m_2d_batch
+    rotation = n_head - o_head
+    translation = n_head - displacement_angle
+    return np.array([
+        [math.cos(rotation), math.sin(rotation), crow_distance_ab*math.cos(translation)],
+        [-math.sin(rotation), math.cos(rotation), -crow_distance_ab*math.sin(translation)],
+        [0., 0., 1.]
+    ], dtype=np.float32)
+
+def local_2_global(local_coords, transform):
+    """Apply a local to global transform to homogenous coordinates"""
+    return normalise_homogenous(np.asarray(local_coords) @ np.asarray(transform).T)
+
+def coordinates_2_tensor(coordinates, values, shape, resolution, base_value, combine, combines):
+    """Combine the values of points into the cells of a dense array"""
+    coordinates = np.asarray(coordinates)
+    values = np.asarray(values)
+    shape = tuple(int(s) for s in np.asarray(shape))
+    if validation.should_validate('coordinates_2_tensor'):
+        assert(coordinates.ndim == 2 and coordinates.shape[1] == len(shape)+1)
+        assert(values.shape == coordinates.shape[0:1])
+        assert(np.all(np.isfinite(coordinates))), "Non finite coordinate"
+    offsets = np.asarray(shape, dtype=np.float32)/np.float32(2.0)
+    points = normalise_homogenous(coordinates)[:,0:-1]
+    indices = np.round(offsets + points/np.asarray(resolution, dtype=points.dtype)).astype(np.int32)
+    mask = np.all(indices >= 0, axis=1) & np.all(indices < shape, axis=1)
+    ids = np.ravel_multi_index(tuple(indices[mask].T), shape) if len(shape) else np.zeros(np.count_nonzero(mask), np.intp)
+    values = values[mask]
+    cells = math.prod(shape)
+    base_value = np.asarray(base_value, dtype=values.dtype)
+
+    count = np.bincount(ids, minlength=cells)
+    occupied = count > 0
+    sums = None
+    channels = []
+    for c in combines:
+        if c in ('add', 'mean') and sums is None:
+            sums = np.bincount(ids, weights=values, minlength=cells)
+        if c == 'add':
+            channel = (base_value + sums).astype(values.dtype)
+        elif c == 'count':
+            channel = base_value + count.astype(values.dtype)
+        elif c == 'mean':
+            channel = (sums/np.maximum(count, 1)).astype(values.dtype)
+        elif c in ('max', 'min'):
+            channel = np.full(cells, base_value, dtype=values.dtype)
+            reduce = np.maximum if c == 'max' else np.minimum
+            # start each occupied cell from one of its own points so base_value doesn't take part
+            channel[ids] = values
+            reduce.at(channel, ids, values)
+        elif c == 'last':
+            position = np.full(cells, -1)
+            np.maximum.at(position, ids, np.arange(len(ids)))
+            channel = np.append(values, base_value)[position]
+        if c not in ('add', 'count'):
+            channel = np.where(occupied, channel, base_value)
+        channels.append(channel)
+    result = np.stack(channels, axis=-1)
+    if isinstance(combine, str):
+        return result.reshape(shape)
+    return result.reshape(shape + (len(combines),))
+
+def tensor_2_coordinates(tensor, resolution):
+    """Get the coordinates and values of the nonzero cells of a dense array"""
+    tensor = np.asarray(tensor)
+    indices = np.argwhere(tensor)
+    values = tensor[tuple(indices.T)]
+    offsets = (np.asarray(tensor.shape, dtype=np.float32)-1)/np.float32(2.0)
+    coordinates = indices.astype(np.float32)-offsets
+    coordinates = np.concatenate([coordinates*np.float32(resolution), np.ones([len(coordinates),1], np.float32)], axis=1)
+    return coordinates, values
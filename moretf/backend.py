@@ -0,0 +1,50 @@
+import os
+import sys
+import contextlib
+
+# Choose what runs the small-batch coordinate functions in coordinate_transformation
+# 'tensorflow' runs them as tensorflow ops (the default)
+# 'numpy' runs normalise_homogenous, latlon_transform_m_2d, local_2_global, coordinates_2_tensor and
+# tensor_2_coordinates on numpy arrays, which avoids the per-op dispatch cost of eager tensorflow
+# for single poses and small point sets.
+# The backend can also be set with the MORETF_BACKEND environment variable.
+# Inside a tf.function the tensorflow backend is always used, so traced functions stay graphs.
+
+BACKENDS = ('tensorflow', 'numpy')
+
+_backend = 'tensorflow'
+
+def set_backend(name):
+    """Set the backend for the coordinate functions
+    name: one of 'tensorflow' or 'numpy'
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS} (value was {name})")
+    _backend = name
+
+def get_backend():
+    """Get the current backend"""
+    return _backend
+
+@contextlib.contextmanager
+def using_backend(name):
+    """Temporarily set the backend
+    name: one of 'tensorflow' or 'numpy'
+    """
+    previous = _backend
+    set_backend(name)
+    try:
+        yield
+    finally:
+        set_backend(previous)
+
+def use_numpy():
+    """Decide whether a call should run on the numpy backend"""
+    if _backend != 'numpy':
+        return False
+    # tensorflow is only imported if something has used it, and nothing can be tracing without it
+    tf = sys.modules.get('tensorflow')
+    return tf is None or tf.executing_eagerly()
+
+set_backend(os.environ.get('MORETF_BACKEND', 'tensorflow'))
@@ -1,12 +1,21 @@
-import tensorflow as tf
 import math
-from haversine import haversine, Unit
-import numpy as np
+import sys
+from collections import OrderedDict
+
+from moretf import validation
+from moretf import backend
+from moretf import _numpy_backend
+from moretf._lazy import lazy_import
+
+# tensorflow, numpy and haversine are imported on first use, so the table and distance
+# functions can be used without loading tensorflow
+tf = lazy_import('tensorflow', globals(), 'tf')
+np = lazy_import('numpy', globals(), 'np')
+haversine = lazy_import('haversine', globals(), 'haversine')
 
 import logging
 log = logging.getLogger(__name__)
 # Driverline functions
-log.info("driverline_functions loaded")
 
 def __angle_interpolation_divided__(x, y, f, full_circle = 360.0):
     """Interpolate an angle
@@ -14,9 +23,11 @@ def __angle_interpolation_divided__(x, y, f, full_circle = 360.0):
     y: finish angle in degrees
     f: interpolation factor
     """
-    assert(0 <= f <= 1)
-    assert(0 <= x <= full_circle)
-    assert(0 <= y <= full_circle)
+    if validation.should_validate('__angle_interpolation_divided__'):
+        # missing angles are nan and give nan, as they do for linear values
+        assert(np.all((0 <= f) & (f <= 1)))
+        assert(np.all(np.isnan(x) | ((0 <= x) & (x <= full_circle))))
+        assert(np.all(np.isnan(y) | ((0 <= y) & (y <= full_circle))))
     a = y - x
     a = (a + full_circle/2) % full_circle - full_circle/2
     return (x+a*f) % full_circle
@@ -51,17 +62,212 @@ def tableInterpolatorDegrees(table, x):
     interpolated = __angle_interpolation_divided__(lastvalue, nextvalue, (x-lasttime)/(nexttime-lasttime))
     return interpolated
 
+def _sorted_table_columns(table):
+    """Sort a table by time once and return its time and value columns as arrays
+    table: a pandas dataframe with column 'Time'
+    """
+    table = table.sort_values('Time')
+    times = np.ascontiguousarray(table.iloc[:,0].to_numpy(dtype=float))
+    values = np.ascontiguousarray(table.iloc[:,1].to_numpy(dtype=float))
+    if len(times) < 2:
+        raise ValueError(f"table needs at least two rows to interpolate (had {len(times)})")
+    return times, values
+
+def _interpolation_positions(times, x):
+    """Find the rows either side of each query time
+    times: sorted array of times
+    x: array of times to interpolate
+    Returns the lower and upper row, the interpolation factor and whether each query is inside the table.
+    """
+    x = np.asarray(x, dtype=float)
+    upper = np.searchsorted(times, x, side='right')
+    inside = (x >= times[0]) & (x <= times[-1])
+    # the last time has no following row, so interpolate it from the final interval
+    upper = np.clip(upper, 1, len(times)-1)
+    lower = upper - 1
+    lasttime = times[lower]
+    # duplicated times make zero width intervals, which take the later row
+    dt = times[upper]-lasttime
+    f = np.clip(np.divide(x-lasttime, dt, out=np.ones_like(x), where=dt>0), 0, 1)
+    return lower, upper, f, inside
+
+def _interpolate_at(values, lower, upper, f, inside, full_circle = None):
+    """Interpolate values between rows found by _interpolation_positions
+    values: array of values with shape (n,) or (n, columns)
+    full_circle: None for linear values, otherwise the size of a full turn of angle values
+    """
+    if values.ndim > 1:
+        f = f[...,np.newaxis]
+        inside = inside[...,np.newaxis]
+    if full_circle is None:
+        interpolated = values[lower] + (values[upper] - values[lower])*f
+    else:
+        interpolated = __angle_interpolation_divided__(values[lower], values[upper], f, full_circle = full_circle)
+    return np.where(inside, interpolated, np.nan)[()]
+
+def _interpolate_sorted(times, values, x, degrees=False):
+    """Interpolate many values at once from sorted time and value arrays
+    times: sorted array of times
+    values: array of values at each time
+    x: array of times to interpolate
+    degrees: whether values are angles in degrees
+    Queries outside [times[0], times[-1]] give nan.
+    """
+    lower, upper, f, inside = _interpolation_positions(times, x)
+    return _interpolate_at(values, lower, upper, f, inside, full_circle = 360.0 if degrees else None)
+
+class TableInterpolator:
+    """Interpolate values from a table that is sorted and indexed once
+    table: a pandas dataframe with column 'Time'
+    degrees: whether the values are angles in degrees
+    Calling the interpolator with a time or array of times searches in O(log n);
+    queries outside the table give nan.
+    """
+    def __init__(self, table, degrees=False):
+        self.times, self.values = _sorted_table_columns(table)
+        self.degrees = degrees
+
+    def __call__(self, x):
+        return _interpolate_sorted(self.times, self.values, x, degrees=self.degrees)
+
+    def cursor(self):
+        """Make a cursor for interpolating a stream of increasing times"""
+        return TableInterpolatorCursor(self)
+
+class TableInterpolatorCursor:
+    """Interpolate a time ordered stream of queries from a TableInterpolator
+    interpolator: the TableInterpolator to read from
+    Each query advances the cursor from where the last one stopped, so a whole
+    stream costs O(n + queries) rather than a search per query.
+    """
+    def __init__(self, interpolator):
+        self.interpolator = interpolator
+        self.index = 0
+        self.last_x = -math.inf
+
+    def __call__(self, x):
+        x = float(x)
+        if x < self.last_x:
+            raise ValueError(f"cursor queries must not go back in time (got {x} after {self.last_x})")
+        self.last_x = x
+        times = self.interpolator.times
+        values = self.interpolator.values
+        if not times[0] <= x <= times[-1]:
+            return math.nan
+        while self.index < len(times)-2 and times[self.index+1] <= x:
+            self.index += 1
+        lasttime = times[self.index]
+        dt = times[self.index+1]-lasttime
+        f = min((x-lasttime)/dt, 1.0) if dt > 0 else 1.0
+        lastvalue = values[self.index]
+        nextvalue = values[self.index+1]
+        if self.interpolator.degrees:
+            return __angle_interpolation_divided__(lastvalue, nextvalue, f)
+        return lastvalue + (nextvalue - lastvalue)*f
+
+_full_circles = {
+    'linear': None,
+    'degrees': 360.0,
+    'radians': 2*math.pi
+}
+
+def resampleTable(table, grid, modes = None):
+    """Resample every column of a table onto a grid of times in one pass
+    table: a pandas dataframe with column 'Time', or an iterable of time ordered dataframe chunks
+    grid: array of times to resample to
+    modes: dict from column name to 'linear', 'degrees' or 'radians' (default 'linear')
+    Returns a dataframe with a 'Time' column holding the grid, with nan outside the table.
+    """
+    import pandas as pd
+    modes = {} if modes is None else modes
+    chunks = [table] if hasattr(table, 'sort_values') else table
+    grid = np.asarray(grid, dtype=float)
+    order = np.argsort(grid, kind='stable')
+    sorted_grid = grid[order]
+
+    columns = None
+    result = None
+    carried = None
+    start = 0
+    for chunk in chunks:
+        chunk = chunk.sort_values('Time')
+        if columns is None:
+            columns = [c for c in chunk.columns if c != 'Time']
+            unknown = set(modes[c] for c in columns if c in modes) - set(_full_circles)
+            if unknown:
+                raise ValueError(f"unknown resampling modes {unknown}")
+            groups = {}
+            for i, c in enumerate(columns):
+                groups.setdefault(modes.get(c, 'linear'), []).append(i)
+            result = np.full((len(grid), len(columns)), np.nan)
+        times = chunk['Time'].to_numpy(dtype=float)
+        values = chunk[columns].to_numpy(dtype=float)
+        if not len(times):
+            # filtered readers can give empty chunks, which add nothing
+            continue
+        if carried is not None:
+            if times[0] < carried[0][-1]:
+                raise ValueError("table chunks must be in time order")
+            times = np.concatenate([carried[0], times])
+            values = np.concatenate([carried[1], values])
+        if len(times) < 2:
+            carried = (times, values)
+            continue
+        # each grid time is resampled from the first chunk that reaches it
+        stop = np.searchsorted(sorted_grid, times[-1], side='right')
+        if stop > start:
+            lower, upper, f, inside = _interpolation_positions(times, sorted_grid[start:stop])
+            for mode, indices in groups.items():
+                full_circle = _full_circles[mode]
+                group_values = values[:,indices]
+                if full_circle is not None:
+                    group_values = group_values % full_circle
+                result[order[start:stop][:,np.newaxis], indices] = _interpolate_at(group_values, lower, upper, f, inside, full_circle = full_circle)
+            start = stop
+        carried = (times[-1:], values[-1:])
+    if columns is None:
+        raise ValueError("table has no rows to resample")
+
+    resampled = pd.DataFrame(result, columns = columns)
+    resampled.insert(0, 'Time', grid)
+    return resampled
+
+def tableInterpolatorBatch(table, x):
+    """Interpolate many values from a table in one pass
+    table: a pandas dataframe with column 'Time'
+    x: array or tensor of times to interpolate
+    Returns an array shaped like x, with nan for times outside the table.
+    """
+    return TableInterpolator(table)(x)
+
+def tableInterpolatorDegreesBatch(table, x):
+    """Interpolate many angles from a table in degrees in one pass
+    table: a pandas dataframe with column 'Time'
+    x: array or tensor of times to interpolate
+    Returns an array shaped like x, with nan for times outside the table.
+    """
+    return TableInterpolator(table, degrees=True)(x)
+
 def normalise_homogenous(x):
     """Normalise a matrix in homogenous coordinates
     x: a matrix with shape (4,4)
     """
-    tf.debugging.assert_type(x, tf.float32)
+    if backend.use_numpy():
+        return _numpy_backend.normalise_homogenous(x)
+    return _normalise_homogenous_tf(x)
+
+def _normalise_homogenous_tf(x):
+    """normalise_homogenous on tensorflow whatever the backend, for functions that keep working on tensors"""
+    validate = validation.should_validate('normalise_homogenous')
+    if validate:
+        tf.debugging.assert_type(x, tf.float32)
     y = tf.transpose(tf.transpose(x)/tf.transpose(x)[-1])
-    tf.debugging.assert_shapes([
-        (x, ('N', 'd')),
-        (y, ('N', 'd'))
-    ])
-    tf.debugging.assert_equal(y[:,-1], 1.0)
+    if validate:
+        tf.debugging.assert_shapes([
+            (x, ('N', 'd')),
+            (y, ('N', 'd'))
+        ])
+        tf.debugging.assert_equal(y[:,-1], 1.0)
     return y
 
 def get_distances_and_angles(a_lat, a_lon, b_lat, b_lon):
@@ -71,23 +277,21 @@ def get_distances_and_angles(a_lat, a_lon, b_lat, b_lon):
     b_lat: latitude of point B
     b_lon: longitude of point B
     """
-    tf.debugging.assert_shapes([
-        (a_lat, ()),
-        (a_lon, ()),
-        (b_lat, ()),
-        (b_lon, ())
-    ])
-    if not -90 <= a_lat <= 90:
-        log.error(f"a_lat looks wrong (value was {a_lat})")
-    if not -90 <= b_lat <= 90:
-        log.error(f"b_lat looks wrong (value was {b_lat})")
-    if not -180 <= a_lon <= 180:
-        log.error(f"a_lon looks wrong (value was {a_lon})")
-    if not -180 <= b_lon <= 180:
-        log.error(f"b_lon looks wrong (value was {b_lon})")
-    crow_distance_ab = haversine((a_lat,a_lon), (b_lat, b_lon), unit=Unit.METERS)
-    east_distance_ab = np.sign(b_lon-a_lon) * haversine(((a_lat+b_lat)/2,a_lon), ((a_lat+b_lat)/2, b_lon), unit=Unit.METERS)
-    north_distance_ab = np.sign(b_lat-a_lat) * haversine((a_lat,(a_lon+b_lon)/2), (b_lat, (a_lon+b_lon)/2), unit=Unit.METERS)
+    validate = validation.should_validate('get_distances_and_angles')
+    if validate:
+        assert(all(np.ndim(x) == 0 for x in (a_lat, a_lon, b_lat, b_lon)))
+        if not -90 <= a_lat <= 90:
+            log.error(f"a_lat looks wrong (value was {a_lat})")
+        if not -90 <= b_lat <= 90:
+            log.error(f"b_lat looks wrong (value was {b_lat})")
+        if not -180 <= a_lon <= 180:
+            log.error(f"a_lon looks wrong (value was {a_lon})")
+        if not -180 <= b_lon <= 180:
+            log.error(f"b_lon looks wrong (value was {b_lon})")
+    meters = haversine.Unit.METERS
+    crow_distance_ab = haversine.haversine((a_lat,a_lon), (b_lat, b_lon), unit=meters)
+    east_distance_ab = np.sign(b_lon-a_lon) * haversine.haversine(((a_lat+b_lat)/2,a_lon), ((a_lat+b_lat)/2, b_lon), unit=meters)
+    north_distance_ab = np.sign(b_lat-a_lat) * haversine.haversine((a_lat,(a_lon+b_lon)/2), (b_lat, (a_lon+b_lon)/2), unit=meters)
     an = math.radians(a_lat)
     ae = math.radians(a_lon)
     bn = math.radians(b_lat)
@@ -98,44 +302,123 @@ def get_distances_and_angles(a_lat, a_lon, b_lat, b_lon):
         math.cos(an)*math.sin(bn)-math.sin(an)*math.cos(bn)*math.cos(be-ae)
     )
 
-    if not -0 <= crow_distance_ab <= 10000:
-        log.error(f"crow_distance_ab looks wrong (value was {crow_distance_ab})")
-    if not -10000 <= east_distance_ab <= 10000:
-        log.error(f"east_distance_ab looks wrong (value was {east_distance_ab})")
-    if not -10000 <= north_distance_ab <= 10000:
-        log.error(f"north_distance_ab looks wrong (value was {north_distance_ab})")
-    tf.debugging.assert_near(east_distance_ab**2 + north_distance_ab**2, crow_distance_ab**2, rtol=0.01)
-    if not -math.pi <= displacement_angle <= math.pi:
-        log.error(f"displacement_angle looks wrong (value was {displacement_angle})")
-    
-    if displacement_angle == 0:
-        assert(east_distance_ab==0)
-        assert(north_distance_ab>=0)
-    if 0< displacement_angle < math.pi/2:
-        assert(east_distance_ab>=0)
-        assert(north_distance_ab>=0)
-    if displacement_angle == math.pi/2:
-        assert(east_distance_ab>=0)
-        assert(north_distance_ab==0)
-    if math.pi/2 < displacement_angle < math.pi:
-        assert(east_distance_ab>=0)
-        assert(north_distance_ab<=0)
-    if displacement_angle == math.pi:
-        assert(east_distance_ab==0)
-        assert(north_distance_ab<=0)
-    if displacement_angle == -math.pi:
-        assert(east_distance_ab==0)
-        assert(north_distance_ab<=0)
-    if -math.pi < displacement_angle < -math.pi/2:
-        assert(east_distance_ab<=0)
-        assert(north_distance_ab<=0)
-    if displacement_angle == -math.pi/2:
-        assert(east_distance_ab<=0)
-        assert(north_distance_ab==0)
-    if -math.pi/2 < displacement_angle < 0:
-        assert(east_distance_ab<=0)
-        assert(north_distance_ab>=0)
-    
+    if validate:
+        if not -0 <= crow_distance_ab <= 10000:
+            log.error(f"crow_distance_ab looks wrong (value was {crow_distance_ab})")
+        if not -10000 <= east_distance_ab <= 10000:
+            log.error(f"east_distance_ab looks wrong (value was {east_distance_ab})")
+        if not -10000 <= north_distance_ab <= 10000:
+            log.error(f"north_distance_ab looks wrong (value was {north_distance_ab})")
+        assert(math.isclose(east_distance_ab**2 + north_distance_ab**2, crow_distance_ab**2, rel_tol=0.01, abs_tol=1e-6))
+        if not -math.pi <= displacement_angle <= math.pi:
+            log.error(f"displacement_angle looks wrong (value was {displacement_angle})")
+
+        if displacement_angle == 0:
+            assert(east_distance_ab==0)
+            assert(north_distance_ab>=0)
+        if 0< displacement_angle < math.pi/2:
+            assert(east_distance_ab>=0)
+            assert(north_distance_ab>=0)
+        if displacement_angle == math.pi/2:
+            assert(east_distance_ab>=0)
+            assert(north_distance_ab==0)
+        if math.pi/2 < displacement_angle < math.pi:
+            assert(east_distance_ab>=0)
+            assert(north_distance_ab<=0)
+        if displacement_angle == math.pi:
+            assert(east_distance_ab==0)
+            assert(north_distance_ab<=0)
+        if displacement_angle == -math.pi:
+            assert(east_distance_ab==0)
+            assert(north_distance_ab<=0)
+        if -math.pi < displacement_angle < -math.pi/2:
+            assert(east_distance_ab<=0)
+            assert(north_distance_ab<=0)
+        if displacement_angle == -math.pi/2:
+            assert(east_distance_ab<=0)
+            assert(north_distance_ab==0)
+        if -math.pi/2 < displacement_angle < 0:
+            assert(east_distance_ab<=0)
+            assert(north_distance_ab>=0)
+
+    return crow_distance_ab, east_distance_ab, north_distance_ab, displacement_angle
+
+# mean earth radius, as used by the haversine package
+_EARTH_RADIUS_M = 6371008.8
+
+def _log_error_if_any(condition, message):
+    """Log an error if any element of a boolean tensor is true
+    condition: boolean tensor of problems
+    message: message to log
+    Works eagerly and inside tf.function, where the message is printed by the graph.
+    """
+    if tf.executing_eagerly():
+        if tf.reduce_any(condition):
+            log.error(message)
+    else:
+        tf.cond(
+            tf.reduce_any(condition),
+            lambda: tf.print("ERROR:", message),
+            lambda: tf.no_op()
+        )
+
+def _as_float64(x):
+    """Convert to a float64 tensor without passing python floats through float32"""
+    return tf.cast(tf.convert_to_tensor(x, dtype_hint=tf.float64), tf.float64)
+
+def _haversine_m(an, ae, bn, be):
+    """Great circle distance in metres between points given in radians"""
+    d = tf.sin((bn-an)*0.5)**2 + tf.cos(an)*tf.cos(bn)*tf.sin((be-ae)*0.5)**2
+    return 2*_EARTH_RADIUS_M*tf.asin(tf.sqrt(d))
+
+def get_distances_and_angles_batch(a_lat, a_lon, b_lat, b_lon):
+    """Get distances and angles between many pairs of points
+    a_lat: latitudes of points A, shape (N,)
+    a_lon: longitudes of points A, shape (N,)
+    b_lat: latitudes of points B, shape (N,)
+    b_lon: longitudes of points B, shape (N,)
+    Returns crow, east and north distances in metres and displacement angles in radians, each as a float64 tensor of shape (N,).
+    """
+    a_lat = _as_float64(a_lat)
+    a_lon = _as_float64(a_lon)
+    b_lat = _as_float64(b_lat)
+    b_lon = _as_float64(b_lon)
+    validate = validation.should_validate('get_distances_and_angles_batch')
+    if validate:
+        tf.debugging.assert_shapes([
+            (a_lat, ('N',)),
+            (a_lon, ('N',)),
+            (b_lat, ('N',)),
+            (b_lon, ('N',))
+        ])
+        _log_error_if_any(tf.abs(a_lat) > 90, "a_lat looks wrong")
+        _log_error_if_any(tf.abs(b_lat) > 90, "b_lat looks wrong")
+        _log_error_if_any(tf.abs(a_lon) > 180, "a_lon looks wrong")
+        _log_error_if_any(tf.abs(b_lon) > 180, "b_lon looks wrong")
+
+    radians = math.pi/180
+    an = a_lat*radians
+    ae = a_lon*radians
+    bn = b_lat*radians
+    be = b_lon*radians
+
+    crow_distance_ab = _haversine_m(an, ae, bn, be)
+    east_distance_ab = tf.sign(be-ae) * _haversine_m((an+bn)/2, ae, (an+bn)/2, be)
+    north_distance_ab = tf.sign(bn-an) * _haversine_m(an, (ae+be)/2, bn, (ae+be)/2)
+    displacement_angle = tf.atan2(
+        tf.sin(be-ae)*tf.cos(bn),
+        tf.cos(an)*tf.sin(bn)-tf.sin(an)*tf.cos(bn)*tf.cos(be-ae)
+    )
+
+    if validate:
+        _log_error_if_any(crow_distance_ab > 10000, "crow_distance_ab looks wrong")
+        _log_error_if_any(tf.abs(east_distance_ab) > 10000, "east_distance_ab looks wrong")
+        _log_error_if_any(tf.abs(north_distance_ab) > 10000, "north_distance_ab looks wrong")
+        tf.debugging.assert_near(east_distance_ab**2 + north_distance_ab**2, crow_distance_ab**2, rtol=0.01)
+        # the east and north distances must lie in the quadrant of the displacement angle
+        tf.debugging.assert_greater_equal(east_distance_ab*tf.sin(displacement_angle), tf.constant(0.0, tf.float64))
+        tf.debugging.assert_greater_equal(north_distance_ab*tf.cos(displacement_angle), tf.constant(0.0, tf.float64))
+
     return crow_distance_ab, east_distance_ab, north_distance_ab, displacement_angle
 
 def latlon_transform_m_2d(
@@ -154,26 +437,35 @@ def latlon_transform_m_2d(
     n_lon: longitude of new origin
     n_head: heading of new origin
     """
-    tf.debugging.assert_shapes([
-        (o_lat, ()),
-        (o_lon, ()),
-        (o_head, ()),
-        (n_lat, ()),
-        (n_lon, ()),
-        (n_head, ())
-    ])
-    if(o_head>2*math.pi or o_head<-2*math.pi):
-        log.error(f"o_head doesn't look like radians (value was {o_head})")
-    if(n_head>2*math.pi or n_head<-2*math.pi):
-        log.error(f"n_head doesn't look like radians (value was {o_head})")
-    
+    if backend.use_numpy():
+        return _numpy_backend.latlon_transform_m_2d(o_lat, o_lon, o_head, n_lat, n_lon, n_head)
+    return _latlon_transform_m_2d_tf(o_lat, o_lon, o_head, n_lat, n_lon, n_head)
+
+def _latlon_transform_m_2d_tf(o_lat, o_lon, o_head, n_lat, n_lon, n_head):
+    """latlon_transform_m_2d on tensorflow whatever the backend, for functions that keep working on tensors"""
+    validate = validation.should_validate('latlon_transform_m_2d')
+    if validate:
+        tf.debugging.assert_shapes([
+            (o_lat, ()),
+            (o_lon, ()),
+            (o_head, ()),
+            (n_lat, ()),
+            (n_lon, ()),
+            (n_head, ())
+        ])
+        if(o_head>2*math.pi or o_head<-2*math.pi):
+            log.error(f"o_head doesn't look like radians (value was {o_head})")
+        if(n_head>2*math.pi or n_head<-2*math.pi):
+            log.error(f"n_head doesn't look like radians (value was {n_head})")
+
     crow_distance_ab, east_distance_ab, north_distance_ab, displacement_angle = get_distances_and_angles(n_lat, n_lon, o_lat, o_lon)
-    
-    assert(math.isclose(east_distance_ab**2+north_distance_ab**2,crow_distance_ab**2,rel_tol=0.01, abs_tol=0.1))
-    
-    log.info(f"latlon transform o_head: {math.degrees(o_head)}")
-    log.info(f"latlon transform n_head: {math.degrees(n_head)}")
-    log.info(f"latlon transform displacement angle: {math.degrees(displacement_angle)}")
+
+    if validate:
+        assert(math.isclose(east_distance_ab**2+north_distance_ab**2,crow_distance_ab**2,rel_tol=0.01, abs_tol=0.1))
+
+        log.info("latlon transform o_head: %s", math.degrees(o_head))
+        log.info("latlon transform n_head: %s", math.degrees(n_head))
+        log.info("latlon transform displacement angle: %s", math.degrees(displacement_angle))
     
     rotate_to_north_1 = tf.constant([
         [math.cos(-o_head),  math.sin(-o_head), 0.],
@@ -207,6 +499,312 @@ def latlon_transform_m_2d(
     
     return rotate_to_new_heading @ rotate_to_north_2 @ translate @ rotate_to_displacement_direction @ rotate_to_north_1
 
+def latlon_transform_m_2d_batch(
+    o_lat,
+    o_lon,
+    o_head,
+    n_lat,
+    n_lon,
+    n_head,
+    dtype = 'float32'
+    ):
+    """Transform points from coordinates centered on many origins and angles to others
+    o_lat: latitudes of origins, shape (B,)
+    o_lon: longitudes of origins, shape (B,)
+    o_head: headings of origins, shape (B,)
+    n_lat: latitudes of new origins, shape (B,)
+    n_lon: longitudes of new origins, shape (B,)
+    n_head: headings of new origins, shape (B,)
+    dtype: dtype of the result
+    Returns a (B,3,3) tensor, each matching latlon_transform_m_2d for the same pose.
+    """
+    o_head = _as_float64(o_head)
+    n_head = _as_float64(n_head)
+    if validation.should_validate('latlon_transform_m_2d_batch'):
+        _log_error_if_any(tf.abs(o_head) > 2*math.pi, "o_head doesn't look like radians")
+        _log_error_if_any(tf.abs(n_head) > 2*math.pi, "n_head doesn't look like radians")
+
+    crow_distance_ab, _, _, displacement_angle = get_distances_and_angles_batch(n_lat, n_lon, o_lat, o_lon)
+
+    # The chain of rotations and translation in latlon_transform_m_2d collapses to
+    # one rotation by n_head-o_head followed by a translation along n_head-displacement_angle
+    rotation = n_head - o_head
+    translation = n_head - displacement_angle
+    zeros = tf.zeros_like(rotation)
+    ones = tf.ones_like(rotation)
+    transform = tf.stack([
+        tf.stack([tf.cos(rotation), tf.sin(rotation), crow_distance_ab*tf.cos(translation)], axis=-1),
+        tf.stack([-tf.sin(rotation), tf.cos(rotation), -crow_distance_ab*tf.sin(translation)], axis=-1),
+        tf.stack([zeros, zeros, ones], axis=-1)
+    ], axis=-2)
+    return tf.cast(transform, dtype)
+
+class LocalTangentPlane:
+    """Fast latlon to metres transforms for a fixed global origin, using the tangent plane at the origin
+    origin_lat: latitude of the global origin
+    origin_lon: longitude of the global origin
+    origin_head: heading of the global origin
+    Poses are projected orthographically onto the east-north plane at the origin, which keeps bearings from the origin
+    exact and shortens a distance r by about r**3/(6*R**2) for an earth radius R: under 4.1mm at 10km and 0.6mm at 5km.
+    Rotations are exact, so that is also the largest difference from latlon_transform_m_2d_batch.
+    """
+    def __init__(self, origin_lat, origin_lon, origin_head = 0.0):
+        self.origin_lat = float(origin_lat)
+        self.origin_lon = float(origin_lon)
+        self.origin_head = float(origin_head)
+        self._sin_lat = math.sin(math.radians(self.origin_lat))
+        self._cos_lat = math.cos(math.radians(self.origin_lat))
+
+    def error_bound(self, distance):
+        """Largest difference in metres from the haversine path for poses up to distance metres from the origin"""
+        return distance**3/(6*_EARTH_RADIUS_M**2)
+
+    def east_north(self, lat, lon):
+        """Get east and north offsets in metres from the origin
+        lat: latitudes, any shape
+        lon: longitudes, same shape as lat
+        Returns east and north as float64 tensors with the shape of lat.
+        """
+        lat = _as_float64(lat)*(math.pi/180)
+        dlon = (_as_float64(lon)-self.origin_lon)*(math.pi/180)
+        # dot products of the unit vector to each point with the east and north vectors at the origin
+        east = _EARTH_RADIUS_M*tf.cos(lat)*tf.sin(dlon)
+        north = _EARTH_RADIUS_M*(tf.sin(lat)*self._cos_lat - tf.cos(lat)*self._sin_lat*tf.cos(dlon))
+        if validation.should_validate('LocalTangentPlane'):
+            _log_error_if_any(east**2 + north**2 > 10000**2, "pose is more than 10km from the tangent plane origin")
+        return east, north
+
+    def transforms(self, lat, lon, head, dtype = 'float32'):
+        """Get the transforms from coordinates centered on many poses to the origin
+        lat: latitudes of the poses, shape (B,)
+        lon: longitudes of the poses, shape (B,)
+        head: headings of the poses, shape (B,)
+        dtype: dtype of the result
+        Returns a (B,3,3) tensor, matching latlon_transform_m_2d_batch(lat, lon, head, origin_lat, origin_lon, origin_head) within error_bound.
+        """
+        east, north = self.east_north(lat, lon)
+        rotation = self.origin_head - _as_float64(head)
+        cos_head = math.cos(self.origin_head)
+        sin_head = math.sin(self.origin_head)
+        zeros = tf.zeros_like(rotation)
+        ones = tf.ones_like(rotation)
+        transform = tf.stack([
+            tf.stack([tf.cos(rotation), tf.sin(rotation), cos_head*north + sin_head*east], axis=-1),
+            tf.stack([-tf.sin(rotation), tf.cos(rotation), cos_head*east - sin_head*north], axis=-1),
+            tf.stack([zeros, zeros, ones], axis=-1)
+        ], axis=-2)
+        return tf.cast(transform, dtype)
+
+    def local_2_global(self, local_coords, lat, lon, head):
+        """Convert local coordinates to global coordinates, as local_2_global with this origin
+        local_coords: local homogenous coordinates, shape (N,3)
+        lat: latitude of the local origin
+        lon: longitude of the local origin
+        head: heading of the local origin
+        """
+        pose = [tf.reshape(_as_float64(x), [1]) for x in (lat, lon, head)]
+        transform = self.transforms(*pose, dtype = local_coords.dtype)[0]
+        return _normalise_homogenous_tf(local_coords @ tf.transpose(transform))
+
+class _LRUCache:
+    """Least recently used cache with hit and miss counts
+    maxsize: how many entries to keep
+    """
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1 (value was {maxsize})")
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, make):
+        """Get the entry for a key, calling make() to build and store it if missing"""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = make()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last = False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self, counts = True):
+        """Drop all entries, and reset the counters unless counts is False"""
+        self._entries.clear()
+        if counts:
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Get the hit and miss counts and the current size, as a dict"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+class PoseTransformCache(_LRUCache):
+    """LRU cache of latlon_transform_m_2d results, keyed on quantized poses
+    maxsize: how many transforms to keep
+    latlon_quantum: poses whose latitudes and longitudes round to the same multiple of this (in degrees) share a transform
+    head_quantum: poses whose headings round to the same multiple of this (in radians) share a transform
+    A transform is built from the first pose seen for its key, so a quantum of q degrees can move points by up to about q*111km
+    """
+    def __init__(self, maxsize = 1024, latlon_quantum = 1e-9, head_quantum = 1e-9):
+        super().__init__(maxsize)
+        if latlon_quantum <= 0 or head_quantum <= 0:
+            raise ValueError(f"quanta must be positive (values were {latlon_quantum} and {head_quantum})")
+        self.latlon_quantum = latlon_quantum
+        self.head_quantum = head_quantum
+
+    def _key(self, o_lat, o_lon, o_head, n_lat, n_lon, n_head):
+        quanta = [self.latlon_quantum, self.latlon_quantum, self.head_quantum]*2
+        return tuple(round(float(value)/quantum) for value, quantum in zip((o_lat, o_lon, o_head, n_lat, n_lon, n_head), quanta))
+
+    def __call__(self, o_lat, o_lon, o_head, n_lat, n_lon, n_head):
+        """Get the transform between two poses, as latlon_transform_m_2d"""
+        key = self._key(o_lat, o_lon, o_head, n_lat, n_lon, n_head)
+        return self.get(key, lambda: latlon_transform_m_2d(o_lat, o_lon, o_head, n_lat, n_lon, n_head))
+
+_transform_cache = None
+
+def set_transform_cache(cache):
+    """Set the PoseTransformCache that local_2_global uses by default
+    cache: a PoseTransformCache, or None to stop caching
+    """
+    global _transform_cache
+    _transform_cache = cache
+
+def get_transform_cache():
+    """Get the PoseTransformCache that local_2_global uses by default, or None"""
+    return _transform_cache
+
+def _coordinates_2_indices(coordinates, shape, resolution, offsets = 'center'):
+    """Find the cell of each point and whether it lies inside the tensor
+    coordinates: homogenous coordinates with shape (N, D+1)
+    shape: shape of the tensor
+    resolution: resolution of the tensor
+    offsets: where the coordinates are relative to, 'center' or the index of the origin
+    Returns int32 indices with shape (N, D) and a boolean mask with shape (N,).
+    """
+    if isinstance(offsets, str):
+        offsets = tf.cast(shape, tf.float32)/2.0
+    # normalise coordinates and drop homogenous dimension
+    indices = tf.cast(tf.math.round(offsets+_normalise_homogenous_tf(coordinates)[:,0:-1]/resolution), tf.int32)
+
+    mask = tf.logical_and(
+        tf.reduce_all(indices>=0, axis=1),
+        tf.reduce_all(indices < shape, axis=1)
+    )
+    return indices, mask
+
+_combiners = ('add', 'count', 'mean', 'max', 'min', 'last')
+
+def _check_combine(combine):
+    """Check a combine argument and return it as a list of combiners"""
+    combines = [combine] if isinstance(combine, str) else list(combine)
+    if not combines or any(c not in _combiners for c in combines):
+        raise ValueError(f"combine must be one of {_combiners} or a list of them (value was {combine})")
+    return combines
+
+def _cell_ids(indices, mask, shape):
+    """Flatten cell indices, sending masked points to an extra cell past the end
+    indices: int32 indices with shape (N, D)
+    mask: boolean mask of points inside the tensor, shape (N,)
+    shape: shape of the tensor
+    Returns the flat cell of each point and the number of cells, as int64 so grids can have more than 2**31 cells.
+    """
+    shape = tf.cast(shape, tf.int64)
+    strides = tf.math.cumprod(shape, exclusive=True, reverse=True)
+    cells = tf.reduce_prod(shape)
+    ids = tf.reduce_sum(tf.cast(indices, tf.int64)*strides, axis=1)
+    return tf.where(mask, ids, cells), cells
+
+def _combine_cells(ids, values, cells, combines, base_value):
+    """Reduce the values of points into cells with each combiner
+    ids: flat cell of each point, with masked points in cell number cells
+    values: values of the points, shape (N,)
+    cells: number of cells
+    combines: list of combiners
+    base_value: value of empty cells
+    Returns a tensor with shape (cells, len(combines)).
+    """
+    base_value = tf.cast(base_value, values.dtype)
+    # one more segment than cells collects the masked points, and is dropped
+    segments = cells + 1
+    # only 'add' can do without knowing which cells have points
+    if any(c != 'add' for c in combines):
+        count = tf.math.unsorted_segment_sum(tf.ones_like(ids), ids, segments)[:-1]
+        occupied = count > 0
+    sums = None
+    channels = []
+    for combine in combines:
+        if combine in ('add', 'mean') and sums is None:
+            sums = tf.math.unsorted_segment_sum(values, ids, segments)[:-1]
+        if combine == 'add':
+            channel = base_value + sums
+        elif combine == 'count':
+            channel = base_value + tf.cast(count, values.dtype)
+        elif combine == 'mean':
+            channel = tf.cast(tf.cast(sums, tf.float64)/tf.cast(tf.maximum(count, 1), tf.float64), values.dtype)
+        elif combine == 'max':
+            channel = tf.math.unsorted_segment_max(values, ids, segments)[:-1]
+        elif combine == 'min':
+            channel = tf.math.unsorted_segment_min(values, ids, segments)[:-1]
+        elif combine == 'last':
+            points = tf.shape(ids)[0]
+            position = tf.math.unsorted_segment_max(tf.range(points), ids, segments)[:-1]
+            channel = tf.gather(tf.concat([values, [base_value]], 0), tf.where(occupied, position, points))
+        if combine not in ('add', 'count'):
+            channel = tf.where(occupied, channel, base_value)
+        channels.append(channel)
+    return tf.stack(channels, axis=-1)
+
+def _scatter_add(indices, mask, values, shape, base_value):
+    """Add the values of points onto a tensor filled with base_value
+    indices: int32 indices with shape (N, D)
+    mask: boolean mask of points inside the tensor, shape (N,)
+    Masked points are sent to the first cell with a value of 0, which keeps the shapes static.
+    """
+    indices = tf.where(mask[:,tf.newaxis], indices, tf.zeros_like(indices))
+    values = tf.where(mask, values, tf.zeros_like(values))
+    return tf.tensor_scatter_nd_add(tf.fill(shape, tf.cast(base_value, values.dtype)), indices, values)
+
+def _reshape_cells(result, shape, combine):
+    """Reshape combined cells to the tensor shape, with a channel axis when several combiners were asked for"""
+    if isinstance(combine, str):
+        return tf.reshape(result, shape)
+    return tf.reshape(result, tf.concat([shape, tf.shape(result)[-1:]], axis=0))
+
+def _combine_cells_sparse(indices, mask, values, shape, combine, combines, base_value):
+    """Combine the values of points into a SparseTensor of the occupied cells
+    Costs memory and time proportional to the number of points rather than the number of cells.
+    """
+    tf.debugging.assert_equal(tf.cast(base_value, values.dtype), tf.zeros([], values.dtype), message="sparse output needs a base_value of 0")
+    ids = tf.boolean_mask(_cell_ids(indices, mask, shape)[0], mask)
+    values = tf.boolean_mask(values, mask)
+    # combine duplicates over the occupied cells only, then put them in row major order
+    occupied, point_cells = tf.unique(ids)
+    result = _combine_cells(point_cells, values, tf.size(occupied), combines, base_value)
+    order = tf.argsort(occupied)
+    occupied = tf.gather(occupied, order)
+    result = tf.gather(result, order)
+    dense_shape = tf.cast(shape, tf.int64)
+    cell_indices = tf.transpose(tf.unravel_index(occupied, dense_shape))
+    if isinstance(combine, str):
+        return tf.SparseTensor(cell_indices, result[:,0], dense_shape)
+    channels = len(combines)
+    channel_indices = tf.tile(tf.range(channels, dtype=tf.int64)[tf.newaxis,:,tf.newaxis], [tf.shape(cell_indices)[0], 1, 1])
+    cell_indices = tf.repeat(cell_indices[:,tf.newaxis,:], channels, axis=1)
+    return tf.SparseTensor(
+        tf.reshape(tf.concat([cell_indices, channel_indices], axis=2), [-1, tf.size(shape)+1]),
+        tf.reshape(result, [-1]),
+        tf.concat([dense_shape, [channels]], axis=0)
+    )
+
 def coordinates_2_tensor(
     coordinates,
     values,
@@ -214,7 +812,8 @@ def coordinates_2_tensor(
     resolution,
     offsets = 'center',
     base_value = 0,
-    combine = 'add'
+    combine = 'add',
+    sparse = False
     ):
     """Convert a long form set of coordinates and values of points to a wide form tensor
     coordinates: list of coordinates
@@ -223,66 +822,144 @@ def coordinates_2_tensor(
     resolution: resolution of the tensor
     offsets: where the coordinates are relative to (must be 'center')
     base_value: value to use for the fill of the tensor
-    combine: how to combine multiple coordinates into a single value (must be 'add')"""
-    tf.debugging.assert_shapes([
-        (coordinates, ('N', 'D+1')),
-        (values, ('N')),
-        (shape, ('D')),
-        (base_value, ())
-    ])
-    tf.debugging.assert_all_finite(coordinates, message="Non finite coordinate")
-    tf.debugging.assert_equal(len(shape)+1, coordinates.shape[1])
-    tf.debugging.assert_equal(tf.rank(coordinates),2)
-    tf.debugging.assert_equal(offsets,'center')
-    tf.debugging.assert_equal(combine,'add')
-
-    if offsets == 'center':
-        offsets = tf.cast(shape, tf.float32)/2.0
-    # normalise coordinates and drop homogenous dimension
-    indices = tf.cast(tf.math.round(offsets+normalise_homogenous(coordinates)[:,0:-1]/resolution), tf.int32)
-    
-    mask = tf.logical_and(
-        tf.reduce_all(indices>=0, axis=1),
-        tf.reduce_all(indices < shape, axis=1)
-    )
-    tf.debugging.assert_shapes([
-        (coordinates, ('N', 'D+1')),
-        (values, ('N')),
-        (shape, ('D')),
-        (indices, ('N', 'D')),
-        (mask, ('N'))
-    ])
+    combine: how to combine multiple coordinates into a single value, one of 'add', 'count', 'mean',
+        'max', 'min' or 'last', or a list of them to get each as a channel of the last axis
+    sparse: return a tf.SparseTensor holding only the occupied cells (base_value must be 0)
+    'add' and 'count' accumulate onto base_value, the other combiners use base_value only for empty cells."""
+    if offsets != 'center':
+        raise ValueError(f"offsets must be 'center' (value was {offsets})")
+    combines = _check_combine(combine)
+    if backend.use_numpy():
+        if sparse:
+            raise ValueError("sparse output needs the tensorflow backend")
+        return _numpy_backend.coordinates_2_tensor(coordinates, values, shape, resolution, base_value, combine, combines)
 
-    indices = tf.boolean_mask(indices, mask)
-    values = tf.boolean_mask(values, mask)
+    validate = validation.should_validate('coordinates_2_tensor')
+    if validate:
+        tf.debugging.assert_shapes([
+            (coordinates, ('N', 'D+1')),
+            (values, ('N')),
+            (shape, ('D')),
+            (base_value, ())
+        ])
+        tf.debugging.assert_all_finite(coordinates, message="Non finite coordinate")
+        tf.debugging.assert_equal(tf.size(shape)+1, tf.shape(coordinates)[1])
+        tf.debugging.assert_equal(tf.rank(coordinates),2)
 
-    result = tf.fill(shape, base_value)
+    indices, mask = _coordinates_2_indices(coordinates, shape, resolution, offsets)
+    if validate:
+        tf.debugging.assert_shapes([
+            (coordinates, ('N', 'D+1')),
+            (values, ('N')),
+            (shape, ('D')),
+            (indices, ('N', 'D')),
+            (mask, ('N'))
+        ])
 
-    tf.debugging.assert_shapes([
-        (values, ('M')),
-        (shape, ('D')),
-        (indices, ('M', 'D')),
-        (result, ('H', 'W'))
-    ])
+    if sparse:
+        return _combine_cells_sparse(indices, mask, values, shape, combine, combines, base_value)
 
-    result = tf.tensor_scatter_nd_add(
-        result,
-        indices = indices,
-        updates = values
-    )
+    if combine == 'add':
+        result = _scatter_add(indices, mask, values, shape, base_value)
+    else:
+        ids, cells = _cell_ids(indices, mask, shape)
+        result = _combine_cells(ids, values, cells, combines, base_value)
+        result = _reshape_cells(result, shape, combine)
 
-    tf.debugging.assert_shapes([
-        (values, ('M')),
-        (shape, ('D')),
-        (indices, ('M', 'D')),
-        (result, ('H', 'W'))
-    ])
+    if validate:
+        tf.debugging.assert_shapes([
+            (values, ('N')),
+            (shape, ('D')),
+            (indices, ('N', 'D'))
+        ])
+        tf.debugging.assert_equal(tf.shape(result)[0:tf.size(shape)], shape)
 
     # if tf.reduce_all(tf.math.is_finite(tf.cast(values,tf.float32))):
     #     tf.debugging.assert_near(tf.reduce_sum(values),tf.reduce_sum(result), rtol=0.01)
 
     return result
 
+def coordinates_2_tensor_batch(
+    coordinates,
+    values,
+    shape,
+    resolution,
+    offsets = 'center',
+    base_value = 0,
+    combine = 'add',
+    lengths = None
+    ):
+    """Convert a batch of long form point sets to a batch of wide form tensors with one scatter
+    coordinates: ragged tensor with shape (B, None, D+1), or padded tensor with shape (B, N, D+1)
+    values: ragged tensor with shape (B, None), or padded tensor with shape (B, N)
+    shape: shape of each tensor
+    resolution: resolution of the tensors
+    offsets: where the coordinates are relative to (must be 'center')
+    base_value: value to use for the fill of the tensors
+    combine: how to combine multiple coordinates into a single value, as for coordinates_2_tensor
+    lengths: number of valid points in each padded point set, shape (B,) (default all of them)
+    Returns a tensor with shape (B, *shape).
+    """
+    if offsets != 'center':
+        raise ValueError(f"offsets must be 'center' (value was {offsets})")
+    combines = _check_combine(combine)
+    shape = tf.convert_to_tensor(shape, tf.int32)
+
+    if isinstance(coordinates, tf.RaggedTensor):
+        batch_size = coordinates.nrows(out_type=tf.int32)
+        batch_ids = tf.cast(coordinates.value_rowids(), tf.int32)
+        coordinates = coordinates.values
+        values = values.values
+        valid = tf.ones_like(batch_ids, dtype=tf.bool)
+    else:
+        coordinates = tf.convert_to_tensor(coordinates)
+        values = tf.convert_to_tensor(values)
+        batch_size = tf.shape(coordinates)[0]
+        points = tf.shape(coordinates)[1]
+        batch_ids = tf.repeat(tf.range(batch_size), points)
+        if lengths is None:
+            valid = tf.ones([batch_size*points], dtype=tf.bool)
+        else:
+            valid = tf.reshape(tf.sequence_mask(lengths, points), [-1])
+        coordinates = tf.reshape(coordinates, [batch_size*points, -1])
+        values = tf.reshape(values, [-1])
+        # padding may not be valid homogenous coordinates, so replace it with the origin
+        origin = tf.one_hot(tf.shape(coordinates)[1]-1, tf.shape(coordinates)[1], dtype=coordinates.dtype)
+        coordinates = tf.where(valid[:,tf.newaxis], coordinates, origin)
+
+    if validation.should_validate('coordinates_2_tensor_batch'):
+        tf.debugging.assert_shapes([
+            (coordinates, ('N', 'D+1')),
+            (values, ('N')),
+            (shape, ('D')),
+            (base_value, ())
+        ])
+        tf.debugging.assert_all_finite(coordinates, message="Non finite coordinate")
+
+    indices, mask = _coordinates_2_indices(coordinates, shape, resolution, offsets)
+    mask = tf.logical_and(mask, valid)
+    indices = tf.concat([batch_ids[:,tf.newaxis], indices], axis=1)
+    batch_shape = tf.concat([[batch_size], shape], axis=0)
+
+    if combine == 'add':
+        return _scatter_add(indices, mask, values, batch_shape, base_value)
+    ids, cells = _cell_ids(indices, mask, batch_shape)
+    result = _combine_cells(ids, values, cells, combines, base_value)
+    return _reshape_cells(result, batch_shape, combine)
+
+def rasterized(shape, resolution, base_value = 0, combine = 'add', num_parallel_calls = -1):
+    """Make a tf.data transformation that rasterizes (coordinates, values) elements, for use with dataset.apply
+    shape: shape of the tensor
+    resolution: resolution of the tensor
+    base_value: value to use for the fill of the tensor
+    combine: how to combine multiple coordinates into a single value, as for coordinates_2_tensor
+    num_parallel_calls: how many elements to rasterize in parallel (default -1, tf.data.AUTOTUNE)
+    """
+    shape = tf.constant(shape, tf.int32)
+    def rasterize(coordinates, values):
+        return coordinates_2_tensor(coordinates, values, shape, resolution, base_value = tf.cast(base_value, values.dtype), combine = combine)
+    return lambda dataset: dataset.map(rasterize, num_parallel_calls = num_parallel_calls)
+
 def local_2_global(
     local_coords,
     local_origin_lat, 
@@ -290,7 +967,8 @@ def local_2_global(
     local_origin_head, 
     global_origin_lat, 
     global_origin_lon, 
-    global_origin_head
+    global_origin_head,
+    transform_cache = None
     ):
     """Convert local coordinates to global coordinates
     local_coords: list of local coordinates
@@ -300,9 +978,13 @@ def local_2_global(
     global_origin_lat: latitude of the global origin
     global_origin_lon: longitude of the global origin
     global_origin_head: heading of the global origin
+    transform_cache: PoseTransformCache to look the transformation up in, defaults to the one set with set_transform_cache
     """
     # calculate local to world transformation
-    loc_2_glob = latlon_transform_m_2d(
+    if transform_cache is None:
+        transform_cache = _transform_cache
+    transform = latlon_transform_m_2d if transform_cache is None else transform_cache
+    loc_2_glob = transform(
         o_lat = local_origin_lat, 
         o_lon = local_origin_lon, 
         o_head = local_origin_head, 
@@ -310,23 +992,98 @@ def local_2_global(
         n_lon = global_origin_lon, 
         n_head = global_origin_head
     )
+    if backend.use_numpy():
+        return _numpy_backend.local_2_global(local_coords, loc_2_glob)
 
     # Apply local to global transformation
     global_coords = normalise_homogenous(local_coords @ tf.transpose(loc_2_glob))
 
     # Do some checks
-    tf.debugging.assert_shapes([
-        (local_coords, ('N',3)),
-        (loc_2_glob, (3,3)),
-        (global_coords, ('N', 3))
-    ])
-    center_local = tf.reduce_mean(local_coords[:,0:2], 0)
-    center_global = tf.reduce_mean(global_coords[:,0:2], 0)
-    var_local = tf.reduce_mean(tf.math.sqrt(tf.reduce_sum(tf.square(local_coords[:,0:2]-center_local),1)))
-    var_global = tf.reduce_mean(tf.math.sqrt(tf.reduce_sum(tf.square(global_coords[:,0:2]-center_global),1)))
-    # tf.debugging.assert_near(var_local, var_global, rtol=0.05)
+    if validation.should_validate('local_2_global'):
+        tf.debugging.assert_shapes([
+            (local_coords, ('N',3)),
+            (loc_2_glob, (3,3)),
+            (global_coords, ('N', 3))
+        ])
+        center_local = tf.reduce_mean(local_coords[:,0:2], 0)
+        center_global = tf.reduce_mean(global_coords[:,0:2], 0)
+        var_local = tf.reduce_mean(tf.math.sqrt(tf.reduce_sum(tf.square(local_coords[:,0:2]-center_local),1)))
+        var_global = tf.reduce_mean(tf.math.sqrt(tf.reduce_sum(tf.square(global_coords[:,0:2]-center_global),1)))
+        # tf.debugging.assert_near(var_local, var_global, rtol=0.05)
     return global_coords
 
+def _frame_spread(coords, row_ids, frames):
+    """Mean distance of points from their frame's centre, for each frame"""
+    xy = coords[:,0:2]
+    center = tf.math.unsorted_segment_mean(xy, row_ids, frames)
+    distance = tf.math.sqrt(tf.reduce_sum(tf.square(xy-tf.gather(center, row_ids)),1))
+    return tf.math.unsorted_segment_mean(distance, row_ids, frames)
+
+def local_2_global_batch(
+    local_coords,
+    local_origin_lat,
+    local_origin_lon,
+    local_origin_head,
+    global_origin_lat,
+    global_origin_lon,
+    global_origin_head,
+    row_splits = None,
+    diagnostics = False
+    ):
+    """Convert local coordinates from many frames to global coordinates in one call
+    local_coords: ragged tensor of local coordinates with shape (F, None, 3), or flat coordinates with shape (N, 3)
+    local_origin_lat: latitude of the local origin of each frame, shape (F,)
+    local_origin_lon: longitude of the local origin of each frame, shape (F,)
+    local_origin_head: heading of the local origin of each frame, shape (F,)
+    global_origin_lat: latitude of the global origin, scalar or shape (F,)
+    global_origin_lon: longitude of the global origin, scalar or shape (F,)
+    global_origin_head: heading of the global origin, scalar or shape (F,)
+    row_splits: row splits of the frames, needed when local_coords is flat
+    diagnostics: also return the mean spread of each frame's points before and after the transform
+    Returns global coordinates in the same layout as local_coords.
+    """
+    if isinstance(local_coords, tf.RaggedTensor):
+        flat_coords = local_coords.values
+        row_ids = local_coords.value_rowids()
+    else:
+        if row_splits is None:
+            raise ValueError("row_splits is needed when local_coords is not a RaggedTensor")
+        flat_coords = tf.convert_to_tensor(local_coords)
+        row_ids = tf.ragged.row_splits_to_segment_ids(row_splits)
+    if validation.should_validate('local_2_global_batch'):
+        tf.debugging.assert_shapes([
+            (flat_coords, ('N', 3)),
+            (row_ids, ('N',))
+        ])
+
+    # calculate local to world transformation of each frame
+    local_origin_lat = _as_float64(local_origin_lat)
+    frames = tf.shape(local_origin_lat)[0]
+    loc_2_glob = latlon_transform_m_2d_batch(
+        o_lat = local_origin_lat,
+        o_lon = local_origin_lon,
+        o_head = local_origin_head,
+        n_lat = tf.broadcast_to(_as_float64(global_origin_lat), [frames]),
+        n_lon = tf.broadcast_to(_as_float64(global_origin_lon), [frames]),
+        n_head = tf.broadcast_to(_as_float64(global_origin_head), [frames]),
+        dtype = flat_coords.dtype
+    )
+
+    # Apply each frame's transformation to its points
+    global_coords = _normalise_homogenous_tf(tf.linalg.matvec(tf.gather(loc_2_glob, row_ids), flat_coords))
+
+    if isinstance(local_coords, tf.RaggedTensor):
+        result = local_coords.with_values(global_coords)
+    else:
+        result = global_coords
+    if diagnostics:
+        return result, _frame_spread(flat_coords, row_ids, frames), _frame_spread(global_coords, row_ids, frames)
+    return result
+
+def _is_sparse(tensor):
+    """Whether tensor is a tf.SparseTensor, without importing tensorflow to find out"""
+    return 'tensorflow' in sys.modules and isinstance(tensor, tf.SparseTensor)
+
 # @tf.function(experimental_relax_shapes=False)
 def tensor_2_coordinates(
     tensor,
@@ -334,17 +1091,135 @@ def tensor_2_coordinates(
     offsets = 'center',
     base = 0.0
     ):
+    """Convert a wide form tensor to a long form set of coordinates and values of its nonzero cells
+    tensor: a dense tensor, or a tf.SparseTensor whose cost is proportional to its stored values
+    resolution: resolution of the tensor
+    offsets: where the coordinates are relative to (must be 'center')
+    base: value of empty cells (must be 0)
+    On the numpy backend dense tensors give numpy arrays, while SparseTensors still use tensorflow.
+    """
+    if backend.use_numpy() and not _is_sparse(tensor):
+        if base != 0:
+            raise ValueError(f"base must be 0 (value was {base})")
+        return _numpy_backend.tensor_2_coordinates(tensor, resolution)
     tf.debugging.assert_equal(base, 0.0)
-    offsets = tf.cast(tf.shape(tensor)-1,tf.float32)/2.0
-    indices = tf.where(tensor)
-    values = tf.gather_nd(tensor, indices)
+    if isinstance(tensor, tf.SparseTensor):
+        tensor = tf.sparse.retain(tensor, tf.not_equal(tensor.values, 0))
+        shape = tensor.dense_shape
+        indices = tensor.indices
+        values = tensor.values
+    else:
+        shape = tf.shape(tensor)
+        indices = tf.where(tensor)
+        values = tf.gather_nd(tensor, indices)
+    offsets = tf.cast(shape-1,tf.float32)/2.0
     coordinates = tf.cast(indices, tf.float32)-offsets
     coordinates = tf.concat([coordinates*resolution, tf.ones([tf.shape(coordinates)[0],1])], axis=1)
-    tf.debugging.assert_equal(tf.rank(tensor)+1,tf.shape(coordinates)[1])
-    tf.debugging.assert_less_equal(tf.shape(coordinates)[0],tf.size(tensor))
-    tf.debugging.assert_shapes([
-        (coordinates, ('N', 'dims+1')),
-        (values, ('N')),
-        (indices, ('N', 'dims')),
-    ])
-    return coordinates, values
\ No newline at end of file
+    if validation.should_validate('tensor_2_coordinates'):
+        tf.debugging.assert_equal(tf.size(shape)+1,tf.shape(coordinates)[1])
+        tf.debugging.assert_less_equal(tf.cast(tf.shape(coordinates)[0], tf.int64),tf.reduce_prod(tf.cast(shape, tf.int64)))
+        tf.debugging.assert_shapes([
+            (coordinates, ('N', 'dims+1')),
+            (values, ('N')),
+            (indices, ('N', 'dims')),
+        ])
+    return coordinates, values
+
+def _local_2_global_graph(
+    local_coords,
+    local_origin_lat,
+    local_origin_lon,
+    local_origin_head,
+    global_origin_lat,
+    global_origin_lon,
+    global_origin_head
+    ):
+    """local_2_global for tensor poses, built only from graph ops"""
+    loc_2_glob = latlon_transform_m_2d_batch(
+        o_lat = local_origin_lat[tf.newaxis],
+        o_lon = local_origin_lon[tf.newaxis],
+        o_head = local_origin_head[tf.newaxis],
+        n_lat = global_origin_lat[tf.newaxis],
+        n_lon = global_origin_lon[tf.newaxis],
+        n_head = global_origin_head[tf.newaxis],
+        dtype = local_coords.dtype
+    )[0]
+    return _normalise_homogenous_tf(local_coords @ tf.transpose(loc_2_glob))
+
+def _pose_signature():
+    return [tf.TensorSpec([], tf.float64)]*6
+
+def _compile(function, input_signature, jit_compile):
+    """Wrap a function in tf.function with a fixed signature
+    XLA cannot run the logging and assertion ops of the runtime checks, so jit compiled
+    functions are traced with the checks skipped in the tracing thread.
+    """
+    if jit_compile:
+        def traced(*args):
+            with validation.checks_skipped():
+                return function(*args)
+    else:
+        traced = function
+    return tf.function(traced, input_signature = input_signature, jit_compile = jit_compile)
+
+def compile_local_2_global(jit_compile = False):
+    """Make a compiled local_2_global that takes tensor poses
+    jit_compile: compile with XLA
+    The returned function takes local_coords with shape (N, 3) and the six pose scalars as float64,
+    and is traced once for any number of points.
+    """
+    return _compile(
+        _local_2_global_graph,
+        [tf.TensorSpec([None, 3], tf.float32)] + _pose_signature(),
+        jit_compile
+    )
+
+def compile_coordinates_2_tensor(shape, resolution, base_value = 0.0, jit_compile = False):
+    """Make a compiled coordinates_2_tensor for a fixed grid
+    shape: shape of the tensor
+    resolution: resolution of the tensor
+    base_value: value to use for the fill of the tensor
+    jit_compile: compile with XLA
+    The returned function takes coordinates with shape (N, D+1) and float32 values with shape (N,),
+    and is traced once for any number of points.
+    """
+    shape = tf.constant(shape, tf.int32)
+    def rasterize(coordinates, values):
+        return coordinates_2_tensor(coordinates, values, shape, resolution, base_value = tf.constant(base_value, tf.float32))
+    return _compile(
+        rasterize,
+        [tf.TensorSpec([None, shape.shape[0]+1], tf.float32), tf.TensorSpec([None], tf.float32)],
+        jit_compile
+    )
+
+def compile_tensor_2_coordinates(resolution, rank = 2, dtype = 'float32'):
+    """Make a compiled tensor_2_coordinates
+    resolution: resolution of the tensor
+    rank: rank of the tensors to convert
+    dtype: dtype of the tensors to convert
+    Finding the occupied cells has a data dependent shape, so this cannot be compiled with XLA.
+    """
+    return tf.function(
+        lambda tensor: tensor_2_coordinates(tensor, resolution),
+        input_signature = [tf.TensorSpec([None]*rank, dtype)]
+    )
+
+def compile_pose_2_tensor(shape, resolution, base_value = 0.0, jit_compile = False, combine = 'add'):
+    """Make a compiled pipeline from local points and poses to a rasterized global grid
+    shape: shape of the tensor
+    resolution: resolution of the tensor
+    base_value: value to use for the fill of the tensor
+    jit_compile: compile with XLA
+    combine: how to combine multiple coordinates into a single value, as for coordinates_2_tensor
+    The returned function takes local_coords with shape (N, 3), float32 values with shape (N,) and
+    the six pose scalars as float64, and runs local_2_global and coordinates_2_tensor as one graph.
+    """
+    shape = tf.constant(shape, tf.int32)
+    def pose_2_tensor(local_coords, values, *pose):
+        global_coords = _local_2_global_graph(local_coords, *pose)
+        return coordinates_2_tensor(global_coords, values, shape, resolution, base_value = tf.constant(base_value, tf.float32), combine = combine)
+    return _compile(
+        pose_2_tensor,
+        [tf.TensorSpec([None, 3], tf.float32), tf.TensorSpec([None], tf.float32)] + _pose_signature(),
+        jit_compile
+    )
@@ -1,28 +1,189 @@
 import tensorflow as tf
+import functools
 
 # Create a block diagonal matrix from a set of input matricies. The axes mask controls which dimensions diagonalisation occurs in
-def block_diagonal(inputs, axes_mask = 1):
-  sizes = tf.constant([x.shape for x in inputs])
-  baseshape = tf.reduce_sum(sizes,0)
-  pre_pad = tf.zeros(baseshape.shape, dtype=tf.int32)
-  paddeds = []
+# output is 'dense' for a tensor, 'sparse' for a tf.SparseTensor or 'operator' for a tf.linalg.LinearOperatorBlockDiag (matrices only)
+# Each block is only padded out to a band of the output and the bands are concatenated, so the cost is proportional to the output
+def block_diagonal(inputs, axes_mask = 1, output = 'dense'):
+  if output not in ('dense', 'sparse', 'operator'):
+    raise ValueError(f"output must be 'dense', 'sparse' or 'operator' (value was {output})")
+  inputs = [tf.convert_to_tensor(x) for x in inputs]
+  rank = len(inputs[0].shape)
+  mask = [axes_mask]*rank if isinstance(axes_mask, int) else list(axes_mask)
+  masked = [axis for axis in range(rank) if mask[axis]]
+  totals = [sum(x.shape[axis] for x in inputs) if mask[axis] else inputs[0].shape[axis] for axis in range(rank)]
+  starts = []
+  start = [0]*rank
   for x in inputs:
-    post_pad = (baseshape-pre_pad-x.shape)*axes_mask
-    paddeds.append(tf.pad(x, tf.stack([pre_pad, post_pad], axis=-1)))
-    pre_pad = (pre_pad + x.shape)*axes_mask
-  return tf.math.reduce_sum(paddeds, axis=0)
+    starts.append(start)
+    start = [start[axis] + x.shape[axis]*mask[axis] for axis in range(rank)]
 
-# Create windows on a dataset, using different spacings for each layer
-# windows is a list of lists. The outer list is has an entry for each input column, the inner one is the list of offsets that are used
-# @tf.function
-def window(input, windows, padvalue = -1):
-  tf.debugging.assert_rank(input, 3)
-  maxwindow = max(max(x) for x in windows)
-  input_padded =tf.pad(input, [[0,0],[maxwindow,0],[0,0]], constant_values=padvalue)
-  kernel = tf.cast(block_diagonal([tf.expand_dims(tf.transpose(tf.reverse(tf.one_hot(x, maxwindow+1),[0,1])),1) for x in windows], [0,1,1]), dtype=input.dtype)
+  if output == 'operator':
+    if rank != 2 or len(masked) != 2:
+      raise ValueError("operator output needs matrices diagonalised in both dimensions")
+    return tf.linalg.LinearOperatorBlockDiag([tf.linalg.LinearOperatorFullMatrix(x) for x in inputs], is_square=False)
+  if output == 'sparse':
+    indices = tf.concat([tf.where(tf.ones_like(x, dtype=tf.bool)) + start for x, start in zip(inputs, starts)], axis=0)
+    values = tf.concat([tf.reshape(x, [-1]) for x in inputs], axis=0)
+    return tf.sparse.reorder(tf.SparseTensor(indices, values, totals))
+  if not masked:
+    return tf.math.reduce_sum(inputs, axis=0)
+
+  bands = []
+  for x, start in zip(inputs, starts):
+    padding = [[0, 0]]*rank
+    for axis in masked[1:]:
+      padding[axis] = [start[axis], totals[axis]-start[axis]-x.shape[axis]]
+    bands.append(tf.pad(x, padding))
+  return tf.concat(bands, axis=masked[0])
+
+# Engines for window, which take the input already padded with maxwindow rows of padvalue
+# Both give each column's offsets in reverse order, as the original one-hot convolution did
+# Each engine has a plan that only depends on the windows spec, so it can be built once and reused
+
+# Convolve with a one-hot kernel. Fast for short windows, but the kernel is mostly zeros for long ones
+def _conv_plan(windows, maxwindow, dtype):
+  return tf.cast(block_diagonal([tf.expand_dims(tf.transpose(tf.reverse(tf.one_hot(x, maxwindow+1),[0,1])),1) for x in windows], [0,1,1]), dtype=dtype)
+
+def _window_conv(input_padded, kernel, maxwindow):
   return tf.nn.conv1d(
       input_padded,
       kernel,
       stride=1,
       padding='VALID'
   )
+
+# Gather each requested offset directly, so the work does not grow with maxwindow
+def _gather_plan(windows, maxwindow, dtype):
+  columns = tf.constant([column for column, x in enumerate(windows) for offset in reversed(x)])
+  starts = tf.constant([maxwindow - offset for x in windows for offset in reversed(x)])
+  return columns, starts
+
+def _window_gather(input_padded, plan, maxwindow):
+  columns, starts = plan
+  steps = tf.shape(input_padded)[1] - maxwindow
+  selected = tf.transpose(tf.gather(input_padded, columns, axis=2), [2,0,1])
+  positions = starts[:,tf.newaxis] + tf.range(steps)[tf.newaxis,:]
+  return tf.transpose(tf.gather(selected, positions, axis=2, batch_dims=1), [1,2,0])
+
+# Above this many kernel rows times columns the convolution's wasted work costs more than the gather (measured on CPU)
+_conv_kernel_limit = 1024
+
+def _window_engine(windows, maxwindow, engine):
+  if engine == 'auto':
+    engine = 'conv' if (maxwindow+1)*len(windows) <= _conv_kernel_limit else 'gather'
+  if engine == 'conv':
+    return _conv_plan, _window_conv
+  if engine == 'gather':
+    return _gather_plan, _window_gather
+  raise ValueError(f"engine must be 'auto', 'conv' or 'gather' (value was {engine})")
+
+# A reusable window for one windows spec and dtype
+# The engine plan is built once, and calls go through a tf.function that is traced once for any batch size and length
+class Windower:
+  def __init__(self, windows, dtype, padvalue = -1, engine = 'auto'):
+    self.windows = [list(x) for x in windows]
+    self.dtype = tf.as_dtype(dtype)
+    self.padvalue = padvalue
+    self.maxwindow = max(max(x) for x in self.windows)
+    make_plan, self._engine = _window_engine(self.windows, self.maxwindow, engine)
+    self.plan = make_plan(self.windows, self.maxwindow, self.dtype)
+    self._window = tf.function(
+      self._window_padded,
+      input_signature=[tf.TensorSpec([None, None, len(self.windows)], self.dtype)]
+    )
+
+  # Window an input that already has maxwindow rows of history in front of it
+  def _window_padded(self, input_padded):
+    return self._engine(input_padded, self.plan, self.maxwindow)
+
+  def __call__(self, input):
+    tf.debugging.assert_rank(input, 3)
+    return self._window(tf.pad(input, [[0,0],[self.maxwindow,0],[0,0]], constant_values=self.padvalue))
+
+# Get a Windower from a bounded cache, so repeated specs reuse the same plan and trace
+# Scalar numpy arrays are cached by their value, and other padvalues that can't key the cache, like tensors, get a Windower of their own
+def get_windower(windows, dtype, padvalue = -1, engine = 'auto'):
+  if hasattr(padvalue, 'item') and getattr(padvalue, 'shape', None) == ():
+    padvalue = padvalue.item()
+  try:
+    hash(padvalue)
+  except TypeError:
+    return Windower(windows, dtype, padvalue, engine)
+  return _cached_windower(tuple(tuple(x) for x in windows), tf.as_dtype(dtype), padvalue, engine)
+
+@functools.lru_cache(maxsize=64)
+def _cached_windower(windows, dtype, padvalue, engine):
+  return Windower(windows, dtype, padvalue, engine)
+
+# Create windows on a dataset, using different spacings for each layer
+# windows is a list of lists. The outer list is has an entry for each input column, the inner one is the list of offsets that are used
+# engine chooses between a one-hot convolution ('conv') and direct gathers ('gather'), or picks one from the window sizes ('auto')
+def window(input, windows, padvalue = -1, engine = 'auto'):
+  input = tf.convert_to_tensor(input)
+  return get_windower(windows, input.dtype, padvalue, engine)(input)
+
+# Window streams that arrive a few timesteps at a time, for online inference
+# Keeps the last maxwindow rows of every stream in a buffer that starts as padvalue,
+# so each push returns exactly the new rows that window() would give on the whole sequence
+class StreamingWindower:
+  def __init__(self, windows, streams, dtype, padvalue = -1, engine = 'auto'):
+    self.windower = get_windower(windows, dtype, padvalue, engine)
+    self.streams = streams
+    self.reset()
+
+  # Start streams again from padvalue. streams is a list of stream indices (default all of them)
+  def reset(self, streams = None):
+    empty = tf.fill([self.streams, self.windower.maxwindow, len(self.windower.windows)], tf.cast(self.windower.padvalue, self.windower.dtype))
+    if streams is None:
+      self.history = empty
+    else:
+      streams = tf.constant(streams, tf.int32)[:,tf.newaxis]
+      self.history = tf.tensor_scatter_nd_update(self.history, streams, tf.gather_nd(empty, streams))
+
+  # Window new timesteps with shape (streams, steps, columns)
+  # streams is a list of which stream each row of input belongs to (default all streams in order)
+  def push(self, input, streams = None):
+    tf.debugging.assert_rank(input, 3)
+    if streams is None:
+      history = self.history
+    else:
+      streams = tf.constant(streams, tf.int32)[:,tf.newaxis]
+      history = tf.gather_nd(self.history, streams)
+    padded = tf.concat([history, tf.cast(input, self.windower.dtype)], axis=1)
+    output = self.windower._window(padded)
+    history = padded[:, tf.shape(padded)[1]-self.windower.maxwindow:]
+    if streams is None:
+      self.history = history
+    else:
+      self.history = tf.tensor_scatter_nd_update(self.history, streams, history)
+    return output
+
+# A tf.data transformation that windows a dataset of sequence chunks, for use with dataset.apply
+# Elements are (sequence_id, rows) pairs with rows shaped (steps, columns), or just rows for a single sequence
+# Chunks of a sequence must arrive together and in order, e.g. from a deterministic interleave over shards
+# The maxwindow rows of history are carried across elements by a scan that resets when the sequence_id changes,
+# and the windowing itself runs in a map with num_parallel_calls
+def windowed(windows, padvalue = -1, engine = 'auto', num_parallel_calls = tf.data.AUTOTUNE):
+  def apply(dataset):
+    keyed = isinstance(dataset.element_spec, tuple)
+    rows_spec = dataset.element_spec[1] if keyed else dataset.element_spec
+    windower = get_windower(windows, rows_spec.dtype, padvalue, engine)
+    empty = tf.fill([windower.maxwindow, len(windower.windows)], tf.cast(windower.padvalue, windower.dtype))
+    key_dtype = dataset.element_spec[0].dtype if keyed else tf.int32
+
+    def carry_history(state, element):
+      last_key, history, started = state
+      key, rows = element if keyed else (tf.zeros([], key_dtype), element)
+      history = tf.cond(tf.logical_and(started, tf.equal(key, last_key)), lambda: history, lambda: empty)
+      padded = tf.concat([history, rows], axis=0)
+      history = padded[tf.shape(padded)[0]-windower.maxwindow:]
+      return (key, history, tf.constant(True)), (key, padded)
+
+    def window_padded(key, padded):
+      output = windower._window(padded[tf.newaxis])[0]
+      return (key, output) if keyed else output
+
+    initial = (tf.zeros([], key_dtype), empty, tf.constant(False))
+    return dataset.scan(initial, carry_history).map(window_padded, num_parallel_calls=num_parallel_calls)
+  return apply
@@ -0,0 +1,281 @@
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from moretf import validation
+from moretf.coordinate_transformation import compile_pose_2_tensor
+
+import logging
+log = logging.getLogger(__name__)
+
+# Run the local_2_global and coordinates_2_tensor pipeline over many independent trajectories at once,
+# either in a pool of spawned worker processes or in a tf.data parallel map in this process.
+
+ENGINES = ('process', 'tf.data')
+
+def _unpack(item):
+    """Split a work item into float32 points, float32 values and a float64 pose"""
+    if len(item) == 3:
+        points, values, pose = item
+    else:
+        points, pose = item
+        values = None
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    if values is None:
+        values = np.ones(len(points), dtype=np.float32)
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    pose = np.asarray(pose, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError(f"points must have shape (N, 3) (shape was {points.shape})")
+    if values.shape != points.shape[0:1]:
+        raise ValueError(f"values must have shape ({len(points)},) (shape was {values.shape})")
+    if pose.shape != (6,):
+        raise ValueError(f"pose must be the six local_2_global origin arguments (shape was {pose.shape})")
+    return points, values, pose
+
+class _SharedArray:
+    """A picklable handle on an array copied into shared memory"""
+    def __init__(self, array):
+        self.memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=self.memory.buf)[...] = array
+        self.name = self.memory.name
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.memory = None
+
+    def read(self):
+        """Copy the array out of shared memory"""
+        memory = shared_memory.SharedMemory(name=self.name)
+        try:
+            return np.ndarray(self.shape, self.dtype, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+
+    def release(self):
+        """Free the shared memory, from the process that made it"""
+        self.memory.close()
+        self.memory.unlink()
+
+_worker_pipeline = None
+
+def _initialise_worker(shape, resolution, base_value, combine, intra_op_threads, validation_level):
+    """Set up tensorflow threading and the compiled pipeline in a worker process"""
+    global _worker_pipeline
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    validation.set_validation_level(validation_level)
+    _worker_pipeline = compile_pose_2_tensor(shape, resolution, base_value, combine = combine)
+
+def _run_item(points, values, pose):
+    """Rasterize one work item in a worker process"""
+    if isinstance(points, _SharedArray):
+        points = points.read()
+    if isinstance(values, _SharedArray):
+        values = values.read()
+    return _worker_pipeline(points, values, *pose).numpy()
+
+class TrajectoryEngine:
+    """Transform and rasterize many independent trajectories across CPU cores
+    shape: shape of each grid
+    resolution: resolution of each grid
+    base_value: value to use for the fill of the grids
+    combine: how to combine multiple coordinates into a single value, as for coordinates_2_tensor
+    workers: worker processes, or parallel calls for 'tf.data' (default os.cpu_count())
+    intra_op_threads: tensorflow intra op threads for each worker
+    engine: 'process' for a pool of spawned processes, or 'tf.data' for a parallel map in this process
+    max_in_flight: most work items taken but not yet delivered (default twice workers)
+    shared_memory_bytes: point and value arrays at least this big reach processes through shared memory
+    on_backpressure: called with stats each time taking another work item has to wait for a result
+    Work items are (points, pose) or (points, values, pose), with homogenous local points of shape (N, 3),
+    values defaulting to ones, and pose the six origin arguments of local_2_global.
+    Grids are delivered as numpy arrays in the order of the work items.
+    """
+    def __init__(
+        self,
+        shape,
+        resolution,
+        base_value = 0.0,
+        combine = 'add',
+        workers = None,
+        intra_op_threads = 1,
+        engine = 'process',
+        max_in_flight = None,
+        shared_memory_bytes = 1 << 20,
+        on_backpressure = None
+        ):
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES} (value was {engine})")
+        self.workers = os.cpu_count() if workers is None else int(workers)
+        if self.workers < 1:
+            raise ValueError(f"workers must be at least 1 (value was {workers})")
+        self.max_in_flight = 2*self.workers if max_in_flight is None else int(max_in_flight)
+        if self.max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1 (value was {max_in_flight})")
+        self.shape = [int(s) for s in shape]
+        self.resolution = resolution
+        self.base_value = float(base_value)
+        self.combine = combine
+        self.intra_op_threads = int(intra_op_threads)
+        self.engine = engine
+        self.shared_memory_bytes = shared_memory_bytes
+        self.on_backpressure = on_backpressure
+        self.stats = {'submitted': 0, 'delivered': 0, 'peak_in_flight': 0, 'waits': 0, 'wait_seconds': 0.0}
+        self._executor = None
+
+    def _submitted(self):
+        self.stats['submitted'] += 1
+        in_flight = self.stats['submitted'] - self.stats['delivered']
+        self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], in_flight)
+
+    def _waited(self, seconds):
+        self.stats['waits'] += 1
+        self.stats['wait_seconds'] += seconds
+        if self.on_backpressure is not None:
+            self.on_backpressure(dict(self.stats))
+
+    def _share(self, array):
+        return _SharedArray(array) if array.nbytes >= self.shared_memory_bytes else array
+
+    def map(self, items):
+        """Rasterize an iterable of work items, yielding grids in order"""
+        if self.engine == 'process':
+            return self._map_processes(items)
+        return self._map_dataset(items)
+
+    def _map_processes(self, items):
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers = self.workers,
+                mp_context = multiprocessing.get_context('spawn'),
+                initializer = _initialise_worker,
+                initargs = (self.shape, self.resolution, self.base_value, self.combine, self.intra_op_threads, validation.get_validation_level())
+            )
+        pending = collections.deque()
+
+        def deliver(wait):
+            future, shared = pending.popleft()
+            start = time.perf_counter()
+            try:
+                grid = future.result()
+            finally:
+                for array in shared:
+                    array.release()
+            if wait:
+                self._waited(time.perf_counter() - start)
+            self.stats['delivered'] += 1
+            return grid
+
+        try:
+            for item in items:
+                if len(pending) >= self.max_in_flight:
+                    yield deliver(True)
+                points, values, pose = _unpack(item)
+                points = self._share(points)
+                values = self._share(values)
+                shared = [a for a in (points, values) if isinstance(a, _SharedArray)]
+                try:
+                    future = self._executor.submit(_run_item, points, values, pose)
+                except Exception:
+                    for array in shared:
+                        array.release()
+                    raise
+                pending.append((future, shared))
+                self._submitted()
+            while pending:
+                yield deliver(False)
+        finally:
+            # the caller stopped early or something failed, so drop what is left
+            for future, shared in pending:
+                future.cancel()
+            for future, shared in pending:
+                concurrent.futures.wait([future])
+                for array in shared:
+                    array.release()
+
+    def _map_dataset(self, items):
+        import tensorflow as tf
+        pipeline = compile_pose_2_tensor(self.shape, self.resolution, self.base_value, combine = self.combine)
+        room = threading.Condition()
+        closed = False
+        failures = []
+
+        def generate():
+            # tf.data would wrap errors raised here, so keep them to raise as they are once the dataset ends
+            try:
+                for item in items:
+                    with room:
+                        if self.stats['submitted'] - self.stats['delivered'] >= self.max_in_flight:
+                            start = time.perf_counter()
+                            while not closed and self.stats['submitted'] - self.stats['delivered'] >= self.max_in_flight:
+                                room.wait(0.1)
+                            self._waited(time.perf_counter() - start)
+                        if closed:
+                            return
+                    unpacked = _unpack(item)
+                    with room:
+                        self._submitted()
+                    yield unpacked
+            except Exception as error:
+                failures.append(error)
+
+        dataset = tf.data.Dataset.from_generator(generate, output_signature = (
+            tf.TensorSpec([None, 3], tf.float32),
+            tf.TensorSpec([None], tf.float32),
+            tf.TensorSpec([6], tf.float64)
+        ))
+        dataset = dataset.map(
+            lambda points, values, pose: pipeline(points, values, *tf.unstack(pose)),
+            num_parallel_calls = self.workers,
+            deterministic = True
+        )
+        options = tf.data.Options()
+        options.threading.private_threadpool_size = self.workers
+        options.threading.max_intra_op_parallelism = self.intra_op_threads
+        dataset = dataset.with_options(options)
+        try:
+            for grid in dataset:
+                with room:
+                    self.stats['delivered'] += 1
+                    room.notify_all()
+                yield grid.numpy()
+            if failures:
+                raise failures[0]
+        finally:
+            with room:
+                closed = True
+                room.notify_all()
+
+    def close(self):
+        """Shut down the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def process_trajectories(items, shape, resolution, **kwargs):
+    """Transform and rasterize many independent trajectories across CPU cores, returning the grids in order
+    items: iterable of (points, pose) or (points, values, pose) work items
+    shape: shape of each grid
+    resolution: resolution of each grid
+    kwargs: passed to TrajectoryEngine
+    """
+    with TrajectoryEngine(shape, resolution, **kwargs) as engine:
+        return list(engine.map(items))
@@ -0,0 +1,295 @@
+import tensorflow as tf
+import numpy as np
+import collections
+import os
+
+from moretf.coordinate_transformation import _coordinates_2_indices, _cell_ids, _combine_cells
+from moretf.coordinate_transformation import _latlon_transform_m_2d_tf, latlon_transform_m_2d_batch, _normalise_homogenous_tf
+
+import logging
+log = logging.getLogger(__name__)
+
+# Rasterizers for grids that are too big, or change too often, to rebuild with coordinates_2_tensor
+
+class TiledRasterizer:
+    """Rasterize a stream of point chunks into fixed size tiles of a large grid
+    shape: shape of the whole grid
+    resolution: resolution of the grid
+    tile_shape: shape of each tile
+    on_tile: function called with the tile index and the tile tensor when a tile is flushed
+    combine: how to combine multiple coordinates into a single value, one of 'add', 'count', 'max', 'min' or 'last'
+    base_value: value to use for the fill of the tiles
+    max_live_tiles: flush the least recently used tile when more than this many are live (default no limit)
+    dtype: dtype of the tiles
+    Points are binned exactly as coordinates_2_tensor bins them on the whole grid, so peak memory is
+    bounded by the tile size times the number of live tiles. Tiles without points are never created.
+    A tile that gets more points after being flushed is flushed again later, holding only the later points.
+    """
+    def __init__(
+        self,
+        shape,
+        resolution,
+        tile_shape,
+        on_tile,
+        combine = 'add',
+        base_value = 0,
+        max_live_tiles = None,
+        dtype = tf.float32
+        ):
+        if combine not in ('add', 'count', 'max', 'min', 'last'):
+            raise ValueError(f"combine must be one of 'add', 'count', 'max', 'min' or 'last' (value was {combine})")
+        self.shape = tf.constant(shape, tf.int32)
+        self.resolution = resolution
+        self.tile_shape = tf.constant(tile_shape, tf.int32)
+        self.tiles_shape = -(-self.shape // self.tile_shape)
+        self.on_tile = on_tile
+        self.combine = combine
+        self.base_value = tf.cast(base_value, dtype)
+        self.max_live_tiles = max_live_tiles
+        self.dtype = dtype
+        self.flushed = set()
+        # tile index -> (combined values, point count), in least recently used order
+        self.tiles = collections.OrderedDict()
+
+    def add(self, coordinates, values):
+        """Rasterize a chunk of points into the live tiles
+        coordinates: homogenous coordinates with shape (N, D+1)
+        values: values of the points with shape (N,)
+        """
+        values = tf.cast(values, self.dtype)
+        indices, mask = _coordinates_2_indices(coordinates, self.shape, self.resolution)
+        indices = tf.boolean_mask(indices, mask)
+        values = tf.boolean_mask(values, mask)
+        tile_indices = indices // self.tile_shape
+        tile_ids, _ = _cell_ids(tile_indices, tf.ones_like(values, dtype=tf.bool), self.tiles_shape)
+        touched, point_tiles = tf.unique(tile_ids)
+        # route each point to its tile in one pass
+        tile_points = tf.dynamic_partition(indices - tile_indices*self.tile_shape, point_tiles, tf.size(touched))
+        tile_values = tf.dynamic_partition(values, point_tiles, tf.size(touched))
+        for tile_id, local_indices, local_values in zip(touched.numpy(), tile_points, tile_values):
+            tile = tuple(np.unravel_index(tile_id, self.tiles_shape.numpy()))
+            self._accumulate(tile, local_indices, local_values)
+
+    def _accumulate(self, tile, local_indices, local_values):
+        """Combine points already routed to one tile into it"""
+        ids, cells = _cell_ids(local_indices, tf.ones_like(local_values, dtype=tf.bool), self.tile_shape)
+        partial = _combine_cells(ids, local_values, cells, [self.combine, 'count'], tf.zeros([], self.dtype))
+        new_values = tf.reshape(partial[:,0], self.tile_shape)
+        new_count = tf.reshape(partial[:,1], self.tile_shape)
+
+        if tile in self.tiles:
+            old_values, old_count = self.tiles.pop(tile)
+        else:
+            if tile in self.flushed:
+                log.warning("tile %s got more points after it was flushed", tile)
+            old_values = tf.fill(self.tile_shape, self.base_value)
+            old_count = tf.zeros(self.tile_shape, self.dtype)
+
+        if self.combine in ('add', 'count'):
+            merged = old_values + new_values
+        else:
+            if self.combine == 'max':
+                both = tf.maximum(old_values, new_values)
+            elif self.combine == 'min':
+                both = tf.minimum(old_values, new_values)
+            else:
+                both = new_values
+            merged = tf.where(new_count > 0, tf.where(old_count > 0, both, new_values), old_values)
+        self.tiles[tile] = (merged, old_count + new_count)
+
+        if self.max_live_tiles is not None:
+            while len(self.tiles) > self.max_live_tiles:
+                self.flush(next(iter(self.tiles)))
+
+    def flush(self, tile = None):
+        """Pass live tiles to on_tile and drop them
+        tile: index of the tile to flush (default all live tiles)
+        """
+        tiles = list(self.tiles) if tile is None else [tile]
+        for tile in tiles:
+            values, _ = self.tiles.pop(tile)
+            # crop tiles on the far edges back to the grid
+            origin = np.array(tile)*self.tile_shape.numpy()
+            size = np.minimum(self.tile_shape.numpy(), self.shape.numpy()-origin)
+            self.flushed.add(tile)
+            self.on_tile(tile, values[tuple(slice(0, s) for s in size)])
+
+def save_tiles(directory):
+    """Make an on_tile callback that saves tiles as .npy files
+    directory: directory to save tiles in
+    A tile flushed more than once is saved again with a numbered suffix.
+    """
+    os.makedirs(directory, exist_ok=True)
+    saves = collections.Counter()
+    def on_tile(tile, values):
+        name = 'tile_' + '_'.join(str(i) for i in tile)
+        if saves[tile]:
+            name = f"{name}_{saves[tile]}"
+        saves[tile] += 1
+        np.save(os.path.join(directory, name + '.npy'), values.numpy())
+    return on_tile
+
+def rasterize_tiled(chunks, shape, resolution, tile_shape, on_tile, **kwargs):
+    """Rasterize an iterator of (coordinates, values) chunks tile by tile
+    chunks: iterable of (coordinates, values) pairs
+    shape: shape of the whole grid
+    resolution: resolution of the grid
+    tile_shape: shape of each tile
+    on_tile: function called with the tile index and the tile tensor when a tile is flushed
+    Other arguments are passed to TiledRasterizer. All tiles are flushed once the chunks run out.
+    """
+    rasterizer = TiledRasterizer(shape, resolution, tile_shape, on_tile, **kwargs)
+    for coordinates, values in chunks:
+        rasterizer.add(coordinates, values)
+    rasterizer.flush()
+
+class RollingLocalMap:
+    """A grid centred on a moving vehicle, updated incrementally in a ring buffer
+    shape: shape of the grid
+    resolution: resolution of the grid
+    anchor_lat: latitude of the fixed frame the grid is aligned to
+    anchor_lon: longitude of the fixed frame the grid is aligned to
+    anchor_head: heading of the fixed frame the grid is aligned to
+    base_value: value of empty cells
+    combine: how to combine multiple coordinates into a single value, one of 'add', 'max' or 'min'
+    dtype: dtype of the grid
+    The grid keeps the orientation of the anchor frame and moves with the vehicle in whole cells,
+    so each update only clears the cells that leave the window and scatters in the new points.
+    With 'max' and 'min', base_value takes part in the comparison.
+    """
+    def __init__(
+        self,
+        shape,
+        resolution,
+        anchor_lat,
+        anchor_lon,
+        anchor_head = 0.0,
+        base_value = 0,
+        combine = 'add',
+        dtype = tf.float32
+        ):
+        if combine not in ('add', 'max', 'min'):
+            raise ValueError(f"combine must be one of 'add', 'max' or 'min' (value was {combine})")
+        self.shape = np.array(shape)
+        self.resolution = resolution
+        self.anchor = (anchor_lat, anchor_lon, anchor_head)
+        self.base_value = tf.cast(base_value, dtype)
+        self.combine = combine
+        self.buffer = tf.Variable(tf.fill(self.shape, self.base_value))
+        # the cell of the anchor frame at the start of the window
+        self.corner = None
+
+    @property
+    def grid(self):
+        """The grid in window order, matching coordinates_2_tensor around the vehicle's cell"""
+        if self.corner is None:
+            return tf.convert_to_tensor(self.buffer)
+        return tf.roll(self.buffer, shift=-(self.corner % self.shape), axis=list(range(len(self.shape))))
+
+    def update(self, lat, lon, head, local_coords, values):
+        """Move the window to a new vehicle pose and add the points seen from it
+        lat: latitude of the vehicle
+        lon: longitude of the vehicle
+        head: heading of the vehicle
+        local_coords: homogenous coordinates of the new points in the vehicle frame, shape (N, 3)
+        values: values of the new points, shape (N,)
+        """
+        vehicle_2_anchor = _latlon_transform_m_2d_tf(lat, lon, head, *self.anchor)
+        # the vehicle's cell is the origin of its transform in the anchor frame
+        center = np.round(vehicle_2_anchor[0:2,2].numpy()/self.resolution).astype(int)
+        corner = center - self.shape//2
+        if self.corner is not None:
+            self._clear_leaving(corner)
+        self.corner = corner
+
+        anchor_coords = _normalise_homogenous_tf(local_coords @ tf.transpose(vehicle_2_anchor))
+        indices, mask = _coordinates_2_indices(anchor_coords, self.shape, self.resolution, offsets = self.shape/2 - center)
+        slots = tf.boolean_mask(indices + corner, mask) % self.shape
+        values = tf.boolean_mask(tf.cast(values, self.buffer.dtype), mask)
+        if self.combine == 'add':
+            self.buffer.scatter_nd_add(slots, values)
+        elif self.combine == 'max':
+            self.buffer.scatter_nd_max(slots, values)
+        else:
+            self.buffer.scatter_nd_min(slots, values)
+
+    def _clear_leaving(self, corner):
+        """Reset the buffer slots of cells that leave the window when it moves to corner"""
+        delta = corner - self.corner
+        if np.any(np.abs(delta) >= self.shape):
+            self.buffer.assign(tf.fill(self.shape, self.base_value))
+            return
+        for axis, (d, size) in enumerate(zip(delta, self.shape)):
+            if d == 0:
+                continue
+            if d > 0:
+                leaving = np.arange(self.corner[axis], self.corner[axis]+d)
+            else:
+                leaving = np.arange(self.corner[axis]+size+d, self.corner[axis]+size)
+            # clear the whole slab of the buffer on this axis
+            ranges = [np.arange(s) for s in self.shape]
+            ranges[axis] = leaving % size
+            slots = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, len(self.shape))
+            self.buffer.scatter_nd_update(slots, tf.fill([len(slots)], self.base_value))
+
+def reproject_grid(
+    grid,
+    resolution,
+    transform = None,
+    source_pose = None,
+    target_pose = None,
+    mode = 'nearest',
+    base_value = 0
+    ):
+    """Warp grids from one frame to another with a single resampling op
+    grid: grid with shape (H, W), or a batch of grids with shape (B, H, W)
+    resolution: resolution of the grids
+    transform: transform from source coordinates to target coordinates, shape (3, 3) or (B, 3, 3)
+    source_pose: (lat, lon, head) of the source frame, used with target_pose instead of transform
+    target_pose: (lat, lon, head) of the target frame
+    mode: 'nearest' or 'bilinear'
+    base_value: value for cells that come from outside the source grid
+    Cells use the same centering as coordinates_2_tensor, so reprojecting a rasterized grid matches
+    rasterizing the transformed points up to the resampling.
+    """
+    if mode not in ('nearest', 'bilinear'):
+        raise ValueError(f"mode must be 'nearest' or 'bilinear' (value was {mode})")
+    if transform is None:
+        if source_pose is None or target_pose is None:
+            raise ValueError("either transform or both source_pose and target_pose are needed")
+        transform = latlon_transform_m_2d_batch(
+            *[tf.reshape(p, [-1]) for p in source_pose],
+            *[tf.reshape(p, [-1]) for p in target_pose]
+        )
+    grid = tf.convert_to_tensor(grid)
+    batched = grid.shape.rank == 3
+    if not batched:
+        grid = grid[tf.newaxis]
+    transform = tf.cast(transform, tf.float32)
+    batch_size = tf.maximum(tf.shape(grid)[0], tf.shape(tf.reshape(transform, [-1, 3, 3]))[0])
+    grid = tf.broadcast_to(grid, tf.concat([[batch_size], tf.shape(grid)[1:]], axis=0))
+    transform = tf.broadcast_to(transform, [batch_size, 3, 3])
+
+    # map each target cell index to the source cell index it comes from
+    size = tf.shape(grid)[1:3]
+    center = tf.cast(size, tf.float32)/2.0
+    index_2_metres = tf.constant([[resolution, 0., 0.], [0., resolution, 0.], [0., 0., 1.]]) @ tf.stack([
+        tf.stack([1., 0., -center[0]]),
+        tf.stack([0., 1., -center[1]]),
+        tf.constant([0., 0., 1.])
+    ])
+    target_2_source = tf.linalg.inv(index_2_metres) @ tf.linalg.inv(transform) @ index_2_metres
+    # the resampling op works in (column, row) order
+    swap = tf.constant([[0., 1., 0.], [1., 0., 0.], [0., 0., 1.]])
+    target_2_source = swap @ target_2_source @ swap
+    target_2_source = target_2_source/target_2_source[:,2:3,2:3]
+
+    result = tf.raw_ops.ImageProjectiveTransformV3(
+        images = grid[...,tf.newaxis],
+        transforms = tf.reshape(target_2_source, [batch_size, 9])[:,0:8],
+        output_shape = size,
+        fill_value = tf.cast(base_value, tf.float32),
+        interpolation = mode.upper(),
+        fill_mode = 'CONSTANT'
+    )[...,0]
+    return result if batched else result[0]
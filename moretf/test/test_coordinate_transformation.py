@@ -1,7 +1,10 @@
 import moretf.coordinate_transformation as ct
+from moretf import backend
 import unittest
 import tensorflow as tf
 import math
+import numpy as np
+import pandas as pd
 from haversine import haversine, Unit
 
 class TestCoordinateTransformation(unittest.TestCase):
@@ -329,3 +332,397 @@ class TestCoordinateTransformation(unittest.TestCase):
         assert(355==ct.__angle_interpolation_divided__(5,355, 1, full_circle = 360.0))
         assert(5==ct.__angle_interpolation_divided__(5,355, 0, full_circle = 360.0))
 
+
+class TestTableInterpolatorBatch(unittest.TestCase):
+    def setUp(self):
+        self.table = pd.DataFrame({
+            'Time': [3.0, 0.0, 1.0, 2.0],
+            'Value': [30.0, 0.0, 10.0, 5.0]
+        })
+        self.headings = pd.DataFrame({
+            'Time': [0.0, 1.0, 2.0],
+            'Heading': [350.0, 10.0, 90.0]
+        })
+
+    def test_matches_scalar(self):
+        x = np.array([0.0, 0.25, 1.5, 2.9])
+        batch = ct.tableInterpolatorBatch(self.table, x)
+        for xi, bi in zip(x, batch):
+            self.assertAlmostEqual(bi, ct.tableInterpolator(self.table, xi))
+        batch = ct.tableInterpolatorDegreesBatch(self.headings, tf.constant([0.5, 1.5]))
+        self.assertAlmostEqual(batch[0], ct.tableInterpolatorDegrees(self.headings, 0.5))
+        self.assertAlmostEqual(batch[1], ct.tableInterpolatorDegrees(self.headings, 1.5))
+
+    def test_edges(self):
+        batch = ct.tableInterpolatorBatch(self.table, [-1.0, 3.0, 4.0])
+        self.assertTrue(np.isnan(batch[0]))
+        self.assertEqual(batch[1], 30.0)
+        self.assertTrue(np.isnan(batch[2]))
+        batch = ct.tableInterpolatorDegreesBatch(self.headings, [2.0, 2.5])
+        self.assertEqual(batch[0], 90.0)
+        self.assertTrue(np.isnan(batch[1]))
+
+    def test_duplicated_final_time(self):
+        table = pd.DataFrame({'Time': [0.0, 1.0, 2.0, 2.0], 'Value': [0.0, 10.0, 20.0, 20.0]})
+        batch = ct.tableInterpolatorBatch(table, [1.5, 2.0])
+        np.testing.assert_array_equal(batch, [15.0, 20.0])
+        self.assertEqual(ct.TableInterpolator(table)(2.0), 20.0)
+        headings = pd.DataFrame({'Time': [0.0, 1.0, 2.0, 2.0], 'Heading': [350.0, 10.0, 90.0, 90.0]})
+        batch = ct.tableInterpolatorDegreesBatch(headings, [0.5, 2.0])
+        np.testing.assert_allclose(batch, [0.0, 90.0], atol=1e-9)
+
+class TestTableInterpolatorObject(unittest.TestCase):
+    def test_cursor_matches_batch(self):
+        table = pd.DataFrame({
+            'Time': np.arange(50.0),
+            'Heading': np.linspace(300.0, 359.0, 50) % 360.0
+        })
+        x = np.linspace(-1.0, 50.0, 211)
+        interpolator = ct.TableInterpolator(table, degrees=True)
+        expected = interpolator(x)
+        cursor = interpolator.cursor()
+        streamed = np.array([cursor(xi) for xi in x])
+        np.testing.assert_allclose(streamed, expected)
+        with self.assertRaises(ValueError):
+            cursor(10.0)
+
+        # duplicated rows in the middle and at the end make zero width intervals
+        table = pd.DataFrame({
+            'Time': [0.0, 1.0, 1.0, 2.0, 3.0, 3.0],
+            'Heading': [350.0, 10.0, 10.0, 40.0, 90.0, 90.0]
+        })
+        x = np.linspace(-0.5, 3.5, 41)
+        interpolator = ct.TableInterpolator(table, degrees=True)
+        expected = interpolator(x)
+        cursor = interpolator.cursor()
+        streamed = np.array([cursor(xi) for xi in x])
+        np.testing.assert_allclose(streamed, expected)
+        self.assertEqual(streamed[-6], 90.0)
+
+class TestResampleTable(unittest.TestCase):
+    def setUp(self):
+        self.table = pd.DataFrame({
+            'Time': np.arange(20.0),
+            'Speed': np.arange(20.0)*2,
+            'Heading': (np.arange(20.0)*10 + 300) % 360,
+            'Yaw': np.linspace(3.0, 3.3, 20)
+        })
+        self.modes = {'Heading': 'degrees', 'Yaw': 'radians'}
+        self.grid = np.array([12.5, -1.0, 0.0, 3.5, 19.0, 25.0])
+
+    def test_resample(self):
+        resampled = ct.resampleTable(self.table, self.grid, self.modes)
+        self.assertEqual(list(resampled.columns), ['Time', 'Speed', 'Heading', 'Yaw'])
+        np.testing.assert_allclose(resampled.Time, self.grid)
+        np.testing.assert_allclose(resampled.Speed, ct.tableInterpolatorBatch(self.table[['Time', 'Speed']], self.grid))
+        np.testing.assert_allclose(resampled.Heading, ct.tableInterpolatorDegreesBatch(self.table[['Time', 'Heading']], self.grid))
+        self.assertAlmostEqual(resampled.Yaw[3], (3.0 + 3.5*0.3/19) % (2*math.pi))
+
+    def test_chunked(self):
+        chunks = [self.table.iloc[i:i+3] for i in range(0, 20, 3)]
+        np.testing.assert_allclose(
+            ct.resampleTable(iter(chunks), self.grid, self.modes).to_numpy(),
+            ct.resampleTable(self.table, self.grid, self.modes).to_numpy()
+        )
+
+    def test_empty_chunks(self):
+        chunks = [self.table.iloc[0:0], self.table.iloc[0:7], self.table.iloc[7:7], self.table.iloc[7:20], self.table.iloc[20:]]
+        np.testing.assert_allclose(
+            ct.resampleTable(iter(chunks), self.grid, self.modes).to_numpy(),
+            ct.resampleTable(self.table, self.grid, self.modes).to_numpy()
+        )
+
+    def test_nan(self):
+        table = self.table.copy()
+        table.loc[12, ['Speed', 'Heading', 'Yaw']] = np.nan
+        resampled = ct.resampleTable(table, self.grid, self.modes)
+        for column in ['Speed', 'Heading', 'Yaw']:
+            self.assertTrue(np.isnan(resampled[column][0]))
+            self.assertFalse(np.isnan(resampled[column][3]))
+
+class TestDistancesAndAnglesBatch(unittest.TestCase):
+    def test_matches_scalar(self):
+        a_lat = [0.0, 51.5, -33.9, 10.0, 10.0]
+        a_lon = [0.0, -0.12, 151.2, 20.0, 20.0]
+        b_lat = [0.001, 51.49, -33.85, 10.0, 9.99]
+        b_lon = [0.0, -0.1, 151.21, 19.99, 20.0]
+        batch = ct.get_distances_and_angles_batch(a_lat, a_lon, b_lat, b_lon)
+        compiled = tf.function(ct.get_distances_and_angles_batch)(
+            tf.constant(a_lat, tf.float64), tf.constant(a_lon, tf.float64), tf.constant(b_lat, tf.float64), tf.constant(b_lon, tf.float64)
+        )
+        for i in range(len(a_lat)):
+            scalar = ct.get_distances_and_angles(a_lat[i], a_lon[i], b_lat[i], b_lon[i])
+            for expected, got, got_compiled in zip(scalar, batch, compiled):
+                self.assertEqual(got.shape, (len(a_lat),))
+                self.assertAlmostEqual(float(got[i]), expected, places=5)
+                self.assertAlmostEqual(float(got_compiled[i]), expected, places=5)
+
+class TestLatlonTransformBatch(unittest.TestCase):
+    def test_matches_scalar(self):
+        poses = [
+            (0.0, 0.0, 0.0, 0.001, 0.0, 0.0),
+            (0.0, 0.001, math.pi/2, 0.0, 0.0, -math.pi/2),
+            (51.5, -0.12, 1.0, 51.49, -0.1, -2.0),
+            (-30.0, -90.0, -math.pi/2, -30.0, -90.0, -math.pi/2),
+            (-33.9, 151.2, math.pi, -33.85, 151.21, 0.3)
+        ]
+        batch = ct.latlon_transform_m_2d_batch(*[[pose[i] for pose in poses] for i in range(6)])
+        self.assertEqual(batch.shape, (len(poses), 3, 3))
+        for pose, transform in zip(poses, batch):
+            tf.debugging.assert_near(transform, ct.latlon_transform_m_2d(*pose), rtol=1e-5, atol=1e-3)
+
+class TestLocal2GlobalBatch(unittest.TestCase):
+    def test_matches_per_frame(self):
+        frames = [
+            (tf.constant([[0.0,0.0,1.0],[100.0,-90.0,1.0]]), 0.0, 0.0, math.pi/2),
+            (tf.constant([[0.0,-100.0,1.0]]), 0.001, 0.0, math.pi),
+            (tf.constant([[-100.0,-100.0,1.0],[5.0,5.0,1.0],[1.0,2.0,1.0]]), 0.0, -0.001, -math.pi/2)
+        ]
+        global_origin = (0.0005, 0.0002, 0.3)
+        ragged = tf.RaggedTensor.from_row_lengths(
+            tf.concat([frame[0] for frame in frames], 0),
+            [frame[0].shape[0] for frame in frames]
+        )
+        poses = [[frame[i] for frame in frames] for i in range(1, 4)]
+        result, spread_local, spread_global = ct.local_2_global_batch(ragged, *poses, *global_origin, diagnostics=True)
+        flat = ct.local_2_global_batch(ragged.values, *poses, *global_origin, row_splits=ragged.row_splits)
+        self.assertIsInstance(result, tf.RaggedTensor)
+        tf.debugging.assert_near(flat, result.values)
+        tf.debugging.assert_near(spread_local, spread_global, rtol=1e-3)
+        for i, frame in enumerate(frames):
+            tf.debugging.assert_near(
+                result[i],
+                ct.local_2_global(frame[0], *frame[1:], *global_origin),
+                atol=1e-2
+            )
+
+class TestCompiled(unittest.TestCase):
+    def test_pose_2_tensor(self):
+        pose = (0.0, 0.0, math.pi/2, 0.0005, 0.0002, 0.3)
+        points = tf.constant([[0.0,0.0,1.0],[10.0,-9.0,1.0],[3.0,4.0,1.0],[1000.0,0.0,1.0]])
+        values = tf.constant([1.0,2.0,3.0,4.0])
+        expected = ct.coordinates_2_tensor(ct.local_2_global(points, *pose), values, tf.constant([64,64]), 2.0, base_value=0.0)
+        pose = [tf.constant(p, tf.float64) for p in pose]
+        for jit_compile in [False, True]:
+            pose_2_tensor = ct.compile_pose_2_tensor([64,64], 2.0, jit_compile=jit_compile)
+            tf.debugging.assert_equal(pose_2_tensor(points, values, *pose), expected)
+            pose_2_tensor(points[:2], values[:2], *pose)
+            self.assertEqual(pose_2_tensor.experimental_get_tracing_count(), 1)
+
+            local_2_global = ct.compile_local_2_global(jit_compile=jit_compile)
+            rasterize = ct.compile_coordinates_2_tensor([64,64], 2.0, jit_compile=jit_compile)
+            tf.debugging.assert_equal(rasterize(local_2_global(points, *pose), values), expected)
+
+        tensor_2_coordinates = ct.compile_tensor_2_coordinates(2.0)
+        coordinates, found = tensor_2_coordinates(expected)
+        self.assertEqual(coordinates.shape, (3, 3))
+        self.assertEqual(float(tf.reduce_sum(found)), 6.0)
+
+class TestCoordinates2TensorBatch(unittest.TestCase):
+    def test_matches_single(self):
+        point_sets = [
+            tf.constant([[0.0,0.0,1.0],[2.0,2.0,1.0],[2.2,1.9,1.0],[100.0,0.0,1.0]]),
+            tf.constant([[-3.0,1.0,1.0]]),
+            tf.constant([[4.0,-4.0,2.0],[0.0,0.0,1.0]])
+        ]
+        value_sets = [tf.constant([1.0,2.0,3.0,4.0]), tf.constant([5.0]), tf.constant([6.0,7.0])]
+        shape = tf.constant([8,10])
+        expected = tf.stack([ct.coordinates_2_tensor(c, v, shape, 1.0, base_value=0.5) for c, v in zip(point_sets, value_sets)])
+
+        ragged = ct.coordinates_2_tensor_batch(
+            tf.RaggedTensor.from_row_lengths(tf.concat(point_sets, 0), [4, 1, 2]),
+            tf.RaggedTensor.from_row_lengths(tf.concat(value_sets, 0), [4, 1, 2]),
+            shape, 1.0, base_value=0.5
+        )
+        tf.debugging.assert_equal(ragged, expected)
+
+        padded = ct.coordinates_2_tensor_batch(
+            tf.stack([tf.pad(c, [[0, 4-c.shape[0]], [0, 0]]) for c in point_sets]),
+            tf.stack([tf.pad(v, [[0, 4-v.shape[0]]], constant_values=100.0) for v in value_sets]),
+            shape, 1.0, base_value=0.5, lengths=[4, 1, 2]
+        )
+        tf.debugging.assert_equal(padded, expected)
+
+        for combine in ['max', ['add', 'last']]:
+            tf.debugging.assert_equal(
+                ct.coordinates_2_tensor_batch(tf.RaggedTensor.from_row_lengths(tf.concat(point_sets, 0), [4, 1, 2]),
+                    tf.RaggedTensor.from_row_lengths(tf.concat(value_sets, 0), [4, 1, 2]), shape, 1.0, combine=combine),
+                tf.stack([ct.coordinates_2_tensor(c, v, shape, 1.0, combine=combine) for c, v in zip(point_sets, value_sets)])
+            )
+
+    def test_more_than_2_31_cells(self):
+        # 300 grids of 3000x3000 are too big to allocate here, so check the flat ids and the 'add' scatter directly
+        ids, cells = ct._cell_ids(tf.constant([[299, 2999, 2999], [1, 0, 5]]), tf.constant([True, True]), tf.constant([300, 3000, 3000]))
+        tf.debugging.assert_equal(ids, tf.constant([300*3000*3000-1, 3000*3000+5], tf.int64))
+        tf.debugging.assert_equal(cells, tf.constant(300*3000*3000, tf.int64))
+        rasterize = tf.function(lambda c, v: ct.coordinates_2_tensor_batch(c, v, tf.constant([3000, 3000]), 1.0))
+        graph = rasterize.get_concrete_function(tf.TensorSpec([300, None, 3], tf.float32), tf.TensorSpec([300, None], tf.float32)).graph
+        ops = [op.type for op in graph.get_operations()]
+        self.assertEqual(ops.count('TensorScatterAdd'), 1)
+        self.assertFalse([op for op in ops if op.startswith('UnsortedSegment')])
+
+class TestCoordinates2TensorCombine(unittest.TestCase):
+    def test_combiners(self):
+        coordinates = tf.constant([[0.0,0.0,1.0],[0.1,0.0,1.0],[0.0,0.1,1.0],[1.0,1.0,1.0],[9.0,9.0,1.0]])
+        values = tf.constant([1.0, 5.0, 3.0, 2.0, 7.0])
+        shape = tf.constant([4,4])
+        combines = ['add', 'count', 'mean', 'max', 'min', 'last']
+        result = ct.coordinates_2_tensor(coordinates, values, shape, 1.0, base_value=-1.0, combine=combines)
+        self.assertEqual(result.shape, (4,4,6))
+        tf.debugging.assert_equal(result[2,2], tf.constant([8.0, 2.0, 3.0, 5.0, 1.0, 3.0]))
+        tf.debugging.assert_equal(result[3,3], tf.constant([1.0, 0.0, 2.0, 2.0, 2.0, 2.0]))
+        tf.debugging.assert_equal(result[0,0], tf.constant([-1.0, -1.0, -1.0, -1.0, -1.0, -1.0]))
+        for i, combine in enumerate(combines):
+            tf.debugging.assert_equal(
+                ct.coordinates_2_tensor(coordinates, values, shape, 1.0, base_value=-1.0, combine=combine),
+                result[:,:,i]
+            )
+        with self.assertRaises(ValueError):
+            ct.coordinates_2_tensor(coordinates, values, shape, 1.0, combine='median')
+
+    def test_add_is_one_scatter(self):
+        # 'add' is the common case, so it must not pay for the segment reductions of the other combiners
+        rasterize = tf.function(lambda c, v: ct.coordinates_2_tensor(c, v, tf.constant([4096,4096]), 1.0))
+        graph = rasterize.get_concrete_function(tf.TensorSpec([None,3], tf.float32), tf.TensorSpec([None], tf.float32)).graph
+        ops = [op.type for op in graph.get_operations()]
+        self.assertEqual(ops.count('TensorScatterAdd'), 1)
+        self.assertFalse([op for op in ops if op.startswith('UnsortedSegment')])
+        coordinates = tf.constant([[0.0,0.0,1.0],[9000.0,0.0,1.0],[-1.0,0.0,1.0]])
+        result = rasterize(coordinates, tf.constant([1.0, 5.0, 3.0]))
+        self.assertEqual(float(tf.reduce_sum(result)), 4.0)
+        self.assertEqual(float(result[0,0]), 0.0)
+
+class TestSparse(unittest.TestCase):
+    def test_round_trip(self):
+        coordinates = tf.constant([[0.0,0.0,1.0],[0.1,0.0,1.0],[-2.0,1.0,1.0],[1.0,-1.0,1.0],[90.0,9.0,1.0]])
+        values = tf.constant([1.0, 5.0, 3.0, 2.0, 7.0])
+        shape = tf.constant([8,8])
+        for combine in ['add', 'max', ['add', 'count']]:
+            dense = ct.coordinates_2_tensor(coordinates, values, shape, 1.0, combine=combine)
+            sparse = ct.coordinates_2_tensor(coordinates, values, shape, 1.0, combine=combine, sparse=True)
+            self.assertIsInstance(sparse, tf.SparseTensor)
+            tf.debugging.assert_equal(tf.sparse.to_dense(sparse), dense)
+        dense = ct.coordinates_2_tensor(coordinates, values, shape, 1.0)
+        sparse = ct.coordinates_2_tensor(coordinates, values, shape, 1.0, sparse=True)
+        for expected, got in zip(ct.tensor_2_coordinates(dense, 1.0), ct.tensor_2_coordinates(sparse, 1.0)):
+            tf.debugging.assert_equal(got, expected)
+
+    def test_more_than_2_31_cells(self):
+        coordinates = tf.constant([[0.0,0.0,1.0],[0.2,0.0,1.0],[-30000.0,40000.0,1.0]])
+        values = tf.constant([1.0, 2.0, 4.0])
+        sparse = ct.coordinates_2_tensor(coordinates, values, tf.constant([100000,100000]), 1.0, sparse=True)
+        tf.debugging.assert_equal(sparse.dense_shape, tf.constant([100000,100000], tf.int64))
+        tf.debugging.assert_equal(sparse.indices, tf.constant([[20000,90000],[50000,50000]], tf.int64))
+        tf.debugging.assert_equal(sparse.values, tf.constant([4.0, 3.0]))
+        coordinates, values = ct.tensor_2_coordinates(sparse, 1.0)
+        tf.debugging.assert_near(coordinates[:,0:2], tf.constant([[-30000.0,40000.0],[0.0,0.0]]), atol=1.0)
+
+class TestRasterized(unittest.TestCase):
+    def test_dataset(self):
+        coordinates = tf.constant([[[0.0,0.0,1.0],[1.0,1.0,1.0]], [[2.0,-1.0,1.0],[2.0,-1.0,1.0]]])
+        values = tf.constant([[1.0,2.0],[3.0,4.0]])
+        dataset = tf.data.Dataset.from_tensor_slices((coordinates, values)).apply(ct.rasterized([4,4], 1.0))
+        for grid, c, v in zip(dataset, coordinates, values):
+            tf.debugging.assert_equal(grid, ct.coordinates_2_tensor(c, v, tf.constant([4,4]), 1.0, base_value=0.0))
+
+class TestPoseTransformCache(unittest.TestCase):
+    pose = (51.5, -0.12, 0.3, 51.501, -0.121, 1.2)
+
+    def test_hits_and_eviction(self):
+        cache = ct.PoseTransformCache(maxsize=2)
+        first = cache(*self.pose)
+        tf.debugging.assert_near(first, ct.latlon_transform_m_2d(*self.pose))
+        self.assertIs(cache(*self.pose), first)
+        cache(51.5, -0.12, 0.3, 51.502, -0.121, 1.2)
+        cache(51.5, -0.12, 0.3, 51.503, -0.121, 1.2)
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2})
+        cache(*self.pose)
+        self.assertEqual(cache.misses, 4)
+
+    def test_quantized(self):
+        cache = ct.PoseTransformCache(latlon_quantum=1e-6, head_quantum=1e-4)
+        cache(*self.pose)
+        cache(51.5+1e-8, -0.12, 0.3+1e-6, 51.501, -0.121, 1.2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with self.assertRaises(ValueError):
+            ct.PoseTransformCache(head_quantum=0)
+
+    def test_local_2_global(self):
+        coords = tf.constant([[1.0, 2.0, 1.0], [-3.0, 0.5, 1.0]])
+        expected = ct.local_2_global(coords, *self.pose)
+        cache = ct.PoseTransformCache()
+        tf.debugging.assert_near(ct.local_2_global(coords, *self.pose, transform_cache=cache), expected)
+        ct.set_transform_cache(cache)
+        try:
+            tf.debugging.assert_near(ct.local_2_global(coords, *self.pose), expected)
+        finally:
+            ct.set_transform_cache(None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+class TestLocalTangentPlane(unittest.TestCase):
+    def test_within_error_bound(self):
+        rng = np.random.default_rng(0)
+        origin = (51.5, -0.12, 0.7)
+        plane = ct.LocalTangentPlane(*origin)
+        distance = 10000*np.sqrt(rng.uniform(size=200))
+        bearing = rng.uniform(-np.pi, np.pi, size=200)
+        lat = origin[0] + np.degrees(distance*np.cos(bearing)/6371008.8)
+        lon = origin[1] + np.degrees(distance*np.sin(bearing)/6371008.8/np.cos(np.radians(lat)))
+        head = rng.uniform(-np.pi, np.pi, size=200)
+        expected = ct.latlon_transform_m_2d_batch(lat, lon, head, *[np.full(200, o) for o in origin], dtype=tf.float64)
+        transforms = plane.transforms(lat, lon, head, dtype=tf.float64)
+        error = tf.reduce_max(tf.abs(transforms - expected))
+        self.assertLess(float(error), plane.error_bound(10000) + 1e-6)
+        self.assertLess(plane.error_bound(10000), 0.005)
+
+    def test_local_2_global(self):
+        plane = ct.LocalTangentPlane(51.5, -0.12, 0.3)
+        coords = tf.constant([[1.0, 2.0, 1.0], [-3.0, 0.5, 1.0]])
+        tf.debugging.assert_near(
+            plane.local_2_global(coords, 51.501, -0.121, 1.2),
+            ct.local_2_global(coords, 51.501, -0.121, 1.2, 51.5, -0.12, 0.3),
+            atol=1e-3
+        )
+
+class TestNumpyBackend(unittest.TestCase):
+    pose = (51.5, -0.12, 0.3, 51.501, -0.121, 1.2)
+
+    def compare(self, function, *args, **kwargs):
+        expected = function(*args, **kwargs)
+        with backend.using_backend('numpy'):
+            result = function(*args, **kwargs)
+        for e, r in zip(tf.nest.flatten(expected), tf.nest.flatten(result)):
+            self.assertIsInstance(r, np.ndarray)
+            self.assertEqual(r.dtype, e.dtype.as_numpy_dtype)
+            np.testing.assert_allclose(r, e.numpy(), rtol=1e-5, atol=1e-3)
+
+    def test_matches_tensorflow(self):
+        rng = np.random.default_rng(0)
+        coords = np.concatenate([rng.uniform(-6, 6, (300, 2)), np.ones((300, 1))], 1).astype(np.float32)
+        values = rng.uniform(-1, 1, 300).astype(np.float32)
+        self.compare(ct.normalise_homogenous, tf.constant(coords*2))
+        self.compare(ct.latlon_transform_m_2d, *self.pose)
+        self.compare(ct.local_2_global, tf.constant(coords), *self.pose)
+        for combine in ['add', 'count', 'mean', 'max', 'min', 'last', ['add', 'max', 'last']]:
+            self.compare(ct.coordinates_2_tensor, tf.constant(coords), tf.constant(values), tf.constant([10, 8]), 1.0, base_value=-2.0, combine=combine)
+        self.compare(ct.coordinates_2_tensor, tf.constant(coords), tf.constant(np.arange(300, dtype=np.int32)), tf.constant([10, 8]), 1.0, combine='add')
+        grid = ct.coordinates_2_tensor(tf.constant(coords), tf.constant(values), tf.constant([10, 8]), 0.5)
+        self.compare(ct.tensor_2_coordinates, grid, 0.5)
+
+    def test_tensor_functions_stay_tensorflow(self):
+        coords = tf.constant([[1.0, 2.0, 1.0], [-3.0, 0.5, 1.0]])
+        plane = ct.LocalTangentPlane(51.5, -0.12, 0.3)
+        expected = plane.local_2_global(coords, 51.501, -0.121, 1.2)
+        with backend.using_backend('numpy'):
+            result = plane.local_2_global(coords, 51.501, -0.121, 1.2)
+        self.assertIsInstance(result, tf.Tensor)
+        tf.debugging.assert_equal(result, expected)
+
+    def test_falls_back_when_tracing(self):
+        traced = tf.function(ct.normalise_homogenous)
+        with backend.using_backend('numpy'):
+            self.assertIsInstance(traced(tf.constant([[2.0, 2.0]])), tf.Tensor)
+            with self.assertRaises(ValueError):
+                ct.coordinates_2_tensor(tf.constant([[0.0, 0.0, 1.0]]), tf.constant([1.0]), tf.constant([2, 2]), 1.0, sparse=True)
+        with self.assertRaises(ValueError):
+            backend.set_backend('jax')
@@ -0,0 +1,40 @@
+import unittest
+import os
+import subprocess
+import sys
+
+import moretf
+
+# Run in a fresh interpreter, since the test process has already imported tensorflow
+def run(code):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(moretf.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return result.stdout.split()
+
+class TestLazyImports(unittest.TestCase):
+    def test_import_is_light(self):
+        loaded = run(
+            "import sys\n"
+            "import moretf.coordinate_transformation, moretf.validation, moretf.backend\n"
+            "print(*[m for m in ('tensorflow', 'numpy', 'haversine') if m in sys.modules])"
+        )
+        self.assertEqual(loaded, [])
+
+    def test_tables_and_distances_without_tensorflow(self):
+        loaded = run(
+            "import sys\n"
+            "import pandas as pd\n"
+            "import moretf.coordinate_transformation as ct\n"
+            "table = pd.DataFrame({'Time': [0.0, 1.0, 2.0], 'Head': [350.0, 10.0, 20.0]})\n"
+            "ct.tableInterpolator(table, 0.5)\n"
+            "ct.tableInterpolatorDegrees(table, 0.5)\n"
+            "ct.TableInterpolator(table, degrees=True)([0.5, 1.5])\n"
+            "ct.TableInterpolator(table).cursor()(0.5)\n"
+            "ct.resampleTable(table, [0.5], modes={'Head': 'degrees'})\n"
+            "ct.get_distances_and_angles(51.5, -0.12, 51.501, -0.121)\n"
+            "print('tensorflow' in sys.modules)"
+        )
+        self.assertEqual(loaded, ['False'])
@@ -1,5 +1,6 @@
 import moretf.moretf as mtf
 import tensorflow as tf
+import numpy as np
 import unittest
 
 class TestBlockDiagonal(unittest.TestCase):
@@ -16,6 +17,23 @@ class TestBlockDiagonal(unittest.TestCase):
             [0,0,8,9,10]
         ])))
 
+    def test_block_diagonal_outputs(self):
+        inputs = [tf.constant([[1.,2.],[3.,4.]]),
+                tf.constant([[5.,6.,7.]]),
+                tf.constant([[8.]])
+        ]
+        dense = mtf.block_diagonal(inputs)
+        self.assertEqual(dense.shape, (4,6))
+        self.assertTrue(tf.reduce_all(tf.sparse.to_dense(mtf.block_diagonal(inputs, output='sparse')) == dense))
+        self.assertTrue(tf.reduce_all(mtf.block_diagonal(inputs, output='operator').to_dense() == dense))
+
+    def test_block_diagonal_axes_mask(self):
+        inputs = [tf.ones([3,1,2], dtype=tf.int32), 2*tf.ones([3,1,1], dtype=tf.int32)]
+        output = mtf.block_diagonal(inputs, [0,1,1])
+        self.assertEqual(output.shape, (3,2,3))
+        self.assertTrue(tf.reduce_all(output == tf.constant([[[1,1,0],[0,0,2]]]*3)))
+        self.assertTrue(tf.reduce_all(tf.sparse.to_dense(mtf.block_diagonal(inputs, [0,1,1], output='sparse')) == output))
+
 class TestWindow(unittest.TestCase):
     def test_window(self):
         input = tf.expand_dims(tf.constant([[1,2,3],[4,5,6],[7,8,9]]),0)
@@ -37,6 +55,74 @@ class TestWindow(unittest.TestCase):
             [1,4,5,6],
             [4,7,8,9]
         ])))
+    def test_window_engines(self):
+        windows = [[0,3,1],[0],[2,5]]
+        for dtype in [tf.int32, tf.float32]:
+            input = tf.cast(tf.reshape(tf.range(2*7*3), [2,7,3]), dtype)
+            conv = mtf.window(input, windows, padvalue=-7, engine='conv')
+            gather = mtf.window(input, windows, padvalue=-7, engine='gather')
+            self.assertEqual(gather.dtype, dtype)
+            self.assertEqual(gather.shape, (2,7,6))
+            self.assertTrue(tf.reduce_all(conv == gather))
+            self.assertTrue(tf.reduce_all(mtf.window(input, windows, padvalue=-7) == gather))
+        self.assertTrue(tf.reduce_all(gather[0,1] == tf.constant([0,-7,3,4,-7,-7], dtype=tf.float32)))
+
+class TestWindower(unittest.TestCase):
+    def test_cached(self):
+        windows = [[0,1],[0],[2]]
+        input = tf.reshape(tf.range(2*5*3, dtype=tf.float32), [2,5,3])
+        windower = mtf.get_windower(windows, tf.float32)
+        self.assertIs(mtf.get_windower([(0,1),(0,),(2,)], tf.float32), windower)
+        self.assertTrue(tf.reduce_all(windower(input) == mtf.window(input, windows, engine='conv')))
+        windower(input[:,0:2])
+        windower(tf.concat([input]*3, 0))
+        self.assertEqual(windower._window.experimental_get_tracing_count(), 1)
+
+    def test_array_padvalues(self):
+        windows = [[0,1],[2]]
+        input = tf.reshape(tf.range(2*5*2, dtype=tf.float32), [2,5,2])
+        expected = mtf.window(input, windows, padvalue=-1)
+        self.assertTrue(tf.reduce_all(mtf.window(input, windows, padvalue=np.array(-1)) == expected))
+        self.assertTrue(tf.reduce_all(mtf.window(input, windows, padvalue=np.float32(-1)) == expected))
+        self.assertTrue(tf.reduce_all(mtf.window(input, windows, padvalue=tf.constant(-1.0)) == expected))
+        self.assertIs(mtf.get_windower(windows, tf.float32, np.array(-1)), mtf.get_windower(windows, tf.float32, -1))
+
+class TestStreamingWindower(unittest.TestCase):
+    def test_matches_window(self):
+        windows = [[0,3,1],[0],[2,5]]
+        input = tf.reshape(tf.range(3*11*3), [3,11,3])
+        expected = mtf.window(input, windows)
+        streaming = mtf.StreamingWindower(windows, 3, tf.int32)
+        outputs = [streaming.push(input[:,a:b]) for a, b in [(0,1),(1,4),(4,4),(4,11)]]
+        self.assertTrue(tf.reduce_all(tf.concat(outputs, 1) == expected))
+
+        # push streams separately and out of step
+        streaming.reset()
+        first = streaming.push(input[2:3,0:6], streams=[2])
+        rest = streaming.push(input[:,0:6][0:2], streams=[0,1])
+        last = streaming.push(input[:,6:11])
+        self.assertTrue(tf.reduce_all(first == expected[2:3,0:6]))
+        self.assertTrue(tf.reduce_all(rest == expected[0:2,0:6]))
+        self.assertTrue(tf.reduce_all(last == expected[:,6:11]))
+
+class TestWindowed(unittest.TestCase):
+    def test_carries_history(self):
+        windows = [[0,2],[1]]
+        first = tf.reshape(tf.range(14), [7,2])
+        second = tf.reshape(tf.range(100, 110), [5,2])
+        chunks = [(0, first[0:3]), (0, first[3:4]), (0, first[4:7]), (1, second[0:1]), (1, second[1:5])]
+        dataset = tf.data.Dataset.from_generator(
+            lambda: iter(chunks),
+            output_signature=(tf.TensorSpec([], tf.int32), tf.TensorSpec([None, 2], tf.int32))
+        ).apply(mtf.windowed(windows))
+        outputs = list(dataset)
+        self.assertEqual([int(key) for key, rows in outputs], [0, 0, 0, 1, 1])
+        self.assertTrue(tf.reduce_all(tf.concat([rows for key, rows in outputs[0:3]], 0) == mtf.window(first[tf.newaxis], windows)[0]))
+        self.assertTrue(tf.reduce_all(tf.concat([rows for key, rows in outputs[3:5]], 0) == mtf.window(second[tf.newaxis], windows)[0]))
+
+        unkeyed = list(tf.data.Dataset.from_tensor_slices(tf.reshape(first, [7,1,2])).apply(mtf.windowed(windows)))
+        self.assertTrue(tf.reduce_all(tf.concat(unkeyed, 0) == mtf.window(first[tf.newaxis], windows)[0]))
+
 # mtf.block_diagonal(inputs)
 
 # input = tf.constant([[
@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import tensorflow as tf
+from moretf import coordinate_transformation as ct
+from moretf.parallel import TrajectoryEngine, process_trajectories
+
+def make_items(count):
+    rng = np.random.default_rng(0)
+    items = []
+    for i in range(count):
+        points = np.concatenate([rng.uniform(-8, 8, (50+10*i, 2)), np.ones((50+10*i, 1))], 1).astype(np.float32)
+        pose = (51.5, -0.12, 0.1*i, 51.50001, -0.12001, 0.3)
+        items.append((points, pose) if i % 2 else (points, rng.uniform(0, 1, len(points)).astype(np.float32), pose))
+    return items
+
+def expected(items):
+    grids = []
+    for item in items:
+        points, pose = item[0], item[-1]
+        values = item[1] if len(item) == 3 else np.ones(len(points), np.float32)
+        global_coords = ct.local_2_global(tf.constant(points), *pose)
+        grids.append(ct.coordinates_2_tensor(global_coords, tf.constant(values), tf.constant([20, 20]), 1.0, base_value=0.0).numpy())
+    return grids
+
+class TestTrajectoryEngine(unittest.TestCase):
+    def check(self, grids, items):
+        self.assertEqual(len(grids), len(items))
+        for grid, reference in zip(grids, expected(items)):
+            np.testing.assert_allclose(grid, reference, atol=1e-5)
+
+    def test_tf_data(self):
+        items = make_items(8)
+        reports = []
+        engine = TrajectoryEngine([20, 20], 1.0, workers=2, engine='tf.data', max_in_flight=2, on_backpressure=reports.append)
+        grids = []
+        for grid in engine.map(iter(items)):
+            grids.append(grid)
+            self.assertLessEqual(engine.stats['submitted'] - engine.stats['delivered'], 2)
+        self.check(grids, items)
+        self.assertEqual(engine.stats['delivered'], 8)
+        self.assertLessEqual(engine.stats['peak_in_flight'], 2)
+        self.assertEqual(len(reports), engine.stats['waits'])
+
+    def test_processes(self):
+        items = make_items(4)
+        reports = []
+        grids = process_trajectories(items, [20, 20], 1.0, workers=1, max_in_flight=1, shared_memory_bytes=0, on_backpressure=reports.append)
+        self.check(grids, items)
+        self.assertEqual(len(reports), 3)
+        self.assertEqual(reports[-1]['peak_in_flight'], 1)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            TrajectoryEngine([20, 20], 1.0, engine='threads')
+        with self.assertRaises(ValueError):
+            list(TrajectoryEngine([20, 20], 1.0, engine='tf.data').map([(np.ones((3, 2)), (0,)*6)]))
@@ -0,0 +1,104 @@
+import moretf.raster as raster
+import moretf.coordinate_transformation as ct
+from moretf import backend
+import tensorflow as tf
+import numpy as np
+import tempfile
+import os
+import math
+import unittest
+
+class TestTiledRasterizer(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.shape = [21, 13]
+        self.coordinates = tf.constant(np.concatenate([rng.uniform(-12, 12, (500, 2)), np.ones((500, 1))], axis=1), tf.float32)
+        self.values = tf.constant(rng.uniform(0, 10, 500), tf.float32)
+
+    def assemble(self, combine, **kwargs):
+        grid = np.full(self.shape, kwargs.get('base_value', 0.0))
+        def on_tile(tile, values):
+            origin = np.array(tile)*4
+            window = tuple(slice(o, o+s) for o, s in zip(origin, values.shape))
+            if combine == 'add':
+                grid[window] += values.numpy()
+            else:
+                grid[window] = values.numpy()
+        chunks = [(self.coordinates[i:i+100], self.values[i:i+100]) for i in range(0, 500, 100)]
+        raster.rasterize_tiled(chunks, self.shape, 1.0, [4, 4], on_tile, combine=combine, **kwargs)
+        return grid
+
+    def test_matches_whole_grid(self):
+        for combine, kwargs in [('add', {'max_live_tiles': 2}), ('max', {'base_value': -1.0}), ('last', {})]:
+            expected = ct.coordinates_2_tensor(self.coordinates, self.values, tf.constant(self.shape), 1.0, combine=combine, base_value=kwargs.get('base_value', 0.0))
+            np.testing.assert_allclose(self.assemble(combine, **kwargs), expected.numpy(), rtol=1e-6)
+
+    def test_save_tiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            raster.rasterize_tiled([(self.coordinates, self.values)], self.shape, 1.0, [8, 8], raster.save_tiles(directory))
+            self.assertEqual(sorted(os.listdir(directory)), sorted(f"tile_{i}_{j}.npy" for i in range(3) for j in range(2)))
+            self.assertEqual(np.load(os.path.join(directory, 'tile_2_1.npy')).shape, (5, 5))
+
+class TestRollingLocalMap(unittest.TestCase):
+    def test_matches_rebuild(self):
+        rng = np.random.default_rng(1)
+        anchor = (0.0, 0.0, 0.0)
+        shape = [16, 20]
+        local_map = raster.RollingLocalMap(shape, 1.0, *anchor)
+        history = []
+        poses = [(0.0, 0.0, 0.0), (0.00002, 0.00001, 0.5), (0.00004, -0.00002, 1.0), (0.001, 0.0, 0.0), (0.00101, 0.00001, -0.3)]
+        for pose in poses:
+            points = tf.constant(np.concatenate([rng.uniform(-5, 5, (30, 2)), np.ones((30, 1))], axis=1), tf.float32)
+            values = tf.constant(rng.uniform(0, 1, 30), tf.float32)
+            local_map.update(*pose, points, values)
+            history.append((ct.local_2_global(points, *pose, *anchor), values))
+
+            # rebuild the window from scratch around the vehicle's cell
+            center = np.round(ct.latlon_transform_m_2d(*pose, *anchor)[0:2,2].numpy())
+            shift = tf.constant([[1.0, 0.0, -center[0]], [0.0, 1.0, -center[1]], [0.0, 0.0, 1.0]])
+            coordinates = tf.concat([c for c, v in history], 0) @ tf.transpose(shift)
+            expected = ct.coordinates_2_tensor(coordinates, tf.concat([v for c, v in history], 0), tf.constant(shape), 1.0, base_value=0.0)
+            np.testing.assert_allclose(local_map.grid.numpy(), expected.numpy(), atol=1e-5)
+
+    def test_numpy_backend(self):
+        rng = np.random.default_rng(2)
+        maps = [raster.RollingLocalMap([16, 20], 1.0, 0.0, 0.0) for _ in range(2)]
+        for pose in [(0.0, 0.0, 0.0), (0.00002, 0.00001, 0.5), (0.0001, -0.00002, 1.0)]:
+            points = tf.constant(np.concatenate([rng.uniform(-5, 5, (30, 2)), np.ones((30, 1))], axis=1), tf.float32)
+            values = tf.constant(rng.uniform(0, 1, 30), tf.float32)
+            maps[0].update(*pose, points, values)
+            with backend.using_backend('numpy'):
+                maps[1].update(*pose, points, values)
+        tf.debugging.assert_equal(maps[1].grid, maps[0].grid)
+
+class TestReprojectGrid(unittest.TestCase):
+    def setUp(self):
+        self.points = tf.constant([[0.0,0.0,1.0],[3.0,-2.0,1.0],[-4.0,5.0,1.0]])
+        self.values = tf.constant([1.0,2.0,3.0])
+        self.shape = tf.constant([16,16])
+        self.grid = ct.coordinates_2_tensor(self.points, self.values, self.shape, 1.0, base_value=0.0)
+
+    def test_matches_rasterized_points(self):
+        transforms = tf.constant([
+            [[1.0,0.0,1.0],[0.0,1.0,0.0],[0.0,0.0,1.0]],
+            [[0.0,1.0,0.0],[-1.0,0.0,0.0],[0.0,0.0,1.0]],
+            [[1.0,0.0,0.0],[0.0,1.0,-2.0],[0.0,0.0,1.0]]
+        ])
+        result = raster.reproject_grid(tf.stack([self.grid]*3), 1.0, transforms)
+        for transform, got in zip(transforms, result):
+            expected = ct.coordinates_2_tensor(self.points @ tf.transpose(transform), self.values, self.shape, 1.0, base_value=0.0)
+            tf.debugging.assert_equal(got, expected)
+            tf.debugging.assert_equal(raster.reproject_grid(self.grid, 1.0, transform, mode='bilinear'), expected)
+
+        half_cell = tf.constant([[1.0,0.0,0.5],[0.0,1.0,0.0],[0.0,0.0,1.0]])
+        result = raster.reproject_grid(self.grid, 1.0, half_cell, mode='bilinear')
+        self.assertAlmostEqual(float(result[8,8]), 0.5)
+        self.assertAlmostEqual(float(result[9,8]), 0.5)
+
+    def test_poses(self):
+        source = (0.0, 0.0, 0.0)
+        target = (0.00002, 0.0, math.pi/2)
+        expected = ct.coordinates_2_tensor(ct.local_2_global(self.points, *source, *target), self.values, self.shape, 1.0, base_value=0.0)
+        result = raster.reproject_grid(self.grid, 1.0, source_pose=source, target_pose=target)
+        self.assertAlmostEqual(float(tf.reduce_sum(result)), 6.0, places=4)
+        tf.debugging.assert_equal(result, expected)
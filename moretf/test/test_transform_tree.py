@@ -0,0 +1,73 @@
+import unittest
+import math
+import pandas as pd
+import tensorflow as tf
+from moretf import coordinate_transformation as ct
+from moretf import backend
+from moretf.transform_tree import TransformTree, pose_2_matrix
+
+class TestTransformTree(unittest.TestCase):
+    def make_tree(self):
+        tree = TransformTree()
+        tree.add_geodetic('vehicle', 'global', pd.DataFrame({
+            'Time': [0.0, 1.0, 2.0],
+            'lat': [51.5, 51.501, 51.502],
+            'lon': [-0.12, -0.121, -0.122],
+            'head': [0.2, 0.4, 6.2]
+        }), 51.5, -0.12, 0.3)
+        tree.add_static('sensor', 'vehicle', 1.5, -0.5, 0.1)
+        tree.add_dynamic('wheel', 'vehicle', pd.DataFrame({
+            'Time': [0.0, 2.0], 'x': [0.0, 2.0], 'y': [1.0, 1.0], 'head': [0.0, 1.0]
+        }))
+        return tree
+
+    def test_matches_latlon_transform(self):
+        tree = self.make_tree()
+        expected = ct.latlon_transform_m_2d(51.5005, -0.1205, 0.3, 51.5, -0.12, 0.3) @ tf.constant(pose_2_matrix(1.5, -0.5, 0.1), tf.float32)
+        tf.debugging.assert_near(tree.lookup('global', 'sensor', 0.5), expected, atol=1e-3)
+        # headings interpolate the short way round
+        tf.debugging.assert_near(
+            tree.lookup('global', 'vehicle', 1.5),
+            ct.latlon_transform_m_2d(51.5015, -0.1215, (0.4+6.2-2*math.pi)/2, 51.5, -0.12, 0.3),
+            atol=1e-3
+        )
+
+    def test_lookup_between_branches(self):
+        tree = self.make_tree()
+        points = tf.constant([[1.0, 2.0, 1.0], [-1.0, 0.5, 1.0]])
+        in_wheel = tree.transform_points('wheel', 'sensor', points, 1.0)
+        via_global = tree.transform_points('wheel', 'global', tree.transform_points('global', 'sensor', points, 1.0), 1.0)
+        tf.debugging.assert_near(in_wheel, via_global, atol=1e-4)
+        tf.debugging.assert_near(tree.transform_points("sensor", "wheel", in_wheel, 1.0), points, atol=1e-4)
+        tf.debugging.assert_near(tree.lookup('vehicle', 'sensor'), tf.constant(pose_2_matrix(1.5, -0.5, 0.1), tf.float32))
+
+    def test_numpy_backend(self):
+        tree = self.make_tree()
+        points = tf.constant([[1.0, 2.0, 1.0], [-1.0, 0.5, 1.0]])
+        expected = tree.transform_points('global', 'sensor', points, 1.0)
+        with backend.using_backend('numpy'):
+            result = tree.transform_points('global', 'sensor', points, 1.0)
+        self.assertIsInstance(result, tf.Tensor)
+        tf.debugging.assert_equal(result, expected)
+
+    def test_cache(self):
+        tree = self.make_tree()
+        first = tree.lookup('global', 'sensor', 0.5)
+        tf.debugging.assert_equal(tree.lookup('global', 'sensor', 0.5), first)
+        tree.lookup('global', 'sensor', 0.75)
+        self.assertEqual(tree.info()['hits'], 1)
+        self.assertEqual(tree.info()['misses'], 2)
+
+    def test_errors(self):
+        tree = self.make_tree()
+        with self.assertRaises(ValueError):
+            tree.lookup('global', 'sensor')
+        with self.assertRaises(ValueError):
+            tree.lookup('global', 'sensor', 3.0)
+        with self.assertRaises(ValueError):
+            tree.add_static('sensor', 'global', 0, 0, 0)
+        with self.assertRaises(ValueError):
+            tree.add_static('global', 'sensor', 0, 0, 0)
+        tree.add_static('other', 'elsewhere', 0, 0, 0)
+        with self.assertRaises(ValueError):
+            tree.lookup('other', 'sensor', 0.5)
@@ -0,0 +1,49 @@
+import moretf.validation as validation
+import moretf.coordinate_transformation as ct
+import tensorflow as tf
+import threading
+import unittest
+
+class TestValidation(unittest.TestCase):
+    def test_levels(self):
+        self.assertEqual(validation.get_validation_level(), 'full')
+        with validation.validation_level('off'):
+            self.assertFalse(validation.should_validate('test'))
+        with validation.validation_level('sampled', every=3):
+            checks = [validation.should_validate('test') for i in range(7)]
+            self.assertEqual(checks, [True, False, False, True, False, False, True])
+        self.assertEqual(validation.get_validation_level(), 'full')
+        self.assertTrue(validation.should_validate('test'))
+        with self.assertRaises(ValueError):
+            validation.set_validation_level('some')
+
+    def test_checks_skipped(self):
+        coordinates = tf.constant([[1.0, 2.0, 1.0]], dtype=tf.float64)
+        with self.assertRaises(Exception):
+            ct.normalise_homogenous(coordinates)
+        with validation.validation_level('off'):
+            tf.debugging.assert_near(ct.normalise_homogenous(coordinates), coordinates)
+
+    def test_checks_skipped_is_local(self):
+        with validation.validation_level('sampled', every=3):
+            self.assertTrue(validation.should_validate('test'))
+            others = []
+            with validation.checks_skipped():
+                self.assertFalse(validation.should_validate('test'))
+                thread = threading.Thread(target=lambda: others.append(validation.should_validate('other')))
+                thread.start()
+                thread.join()
+                self.assertEqual(validation.get_validation_level(), 'sampled')
+            self.assertEqual(others, [True])
+            # the skipped call did not count, so sampling carries on from the first call
+            self.assertEqual([validation.should_validate('test') for i in range(3)], [False, False, True])
+
+    def test_jit_tracing_keeps_level(self):
+        with validation.validation_level('sampled', every=3):
+            validation.should_validate('test')
+            counts = dict(validation._counts)
+            local_2_global = ct.compile_local_2_global(jit_compile=True)
+            pose = [tf.constant(v, tf.float64) for v in (0.0, 0.0, 0.0, 0.0001, 0.0, 0.0)]
+            local_2_global(tf.constant([[1.0, 2.0, 1.0]]), *pose)
+            self.assertEqual(validation.get_validation_level(), 'sampled')
+            self.assertEqual(validation._counts, counts)
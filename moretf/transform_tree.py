@@ -0,0 +1,203 @@
+import tensorflow as tf
+import numpy as np
+import math
+
+from moretf.coordinate_transformation import _interpolation_positions, _interpolate_at
+from moretf.coordinate_transformation import latlon_transform_m_2d_batch, _normalise_homogenous_tf, _LRUCache
+
+import logging
+log = logging.getLogger(__name__)
+
+# A tree of 2d frames, like ROS tf, for chaining sensor, vehicle, local and global coordinates
+# Every frame has a pose in its parent, given as (x, y, head) in metres and radians with the same
+# conventions as latlon_transform_m_2d, so a frame's transform maps its coordinates into its parent's.
+
+def pose_2_matrix(x, y, head):
+    """Make the homogenous transform from a frame to its parent
+    x: x position of the frame's origin in the parent
+    y: y position of the frame's origin in the parent
+    head: heading of the frame in the parent, in radians
+    Works on arrays of poses, giving shape (..., 3, 3).
+    """
+    x, y, head = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(head, dtype=float))
+    cos = np.cos(head)
+    sin = np.sin(head)
+    zeros = np.zeros_like(head)
+    ones = np.ones_like(head)
+    return np.stack([
+        np.stack([cos, -sin, x], axis=-1),
+        np.stack([sin, cos, y], axis=-1),
+        np.stack([zeros, zeros, ones], axis=-1)
+    ], axis=-2)
+
+class _PoseTrack:
+    """Poses of a frame over time, sorted and indexed once
+    table: a pandas dataframe with column 'Time' and the given pose columns
+    columns: the three pose columns
+    full_circles: None or the size of a full turn for each column
+    """
+    def __init__(self, table, columns, full_circles):
+        missing = set(('Time',) + tuple(columns)) - set(table.columns)
+        if missing:
+            raise ValueError(f"pose table is missing columns {missing}")
+        table = table.sort_values('Time')
+        self.times = table['Time'].to_numpy(dtype=float)
+        if len(self.times) < 2:
+            raise ValueError(f"pose table needs at least two rows to interpolate (had {len(self.times)})")
+        self.values = [table[c].to_numpy(dtype=float) for c in columns]
+        self.full_circles = full_circles
+        for i, full_circle in enumerate(full_circles):
+            if full_circle is not None:
+                self.values[i] = self.values[i] % full_circle
+
+    def __call__(self, t):
+        if t is None:
+            raise ValueError("frame moves, so lookup needs a time")
+        lower, upper, f, inside = _interpolation_positions(self.times, t)
+        if not np.all(inside):
+            raise ValueError(f"time {t} is outside the pose table ({self.times[0]} to {self.times[-1]})")
+        return [_interpolate_at(v, lower, upper, f, inside, full_circle = c) for v, c in zip(self.values, self.full_circles)]
+
+class TransformTree:
+    """Register static and time varying frames and look up the transforms between them
+    maxsize: how many composed transforms to cache
+    time_quantum: lookups whose times round to the same multiple of this share a cached transform
+    A cached transform is interpolated at the first time seen for its bucket, so the time quantum
+    should be small next to how fast the frames move. Changing the tree clears the cache.
+    """
+    def __init__(self, maxsize = 1024, time_quantum = 1e-6):
+        self._cache = _LRUCache(maxsize)
+        if time_quantum <= 0:
+            raise ValueError(f"time_quantum must be positive (value was {time_quantum})")
+        self.time_quantum = time_quantum
+        self._parents = {}
+        self._poses = {}
+
+    def _add(self, frame, parent, pose):
+        if self._parents.get(frame) is not None:
+            raise ValueError(f"frame {frame} already has parent {self._parents[frame]}")
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor == frame:
+                raise ValueError(f"making {parent} the parent of {frame} would make a cycle")
+            ancestor = self._parents.get(ancestor)
+        self._parents.setdefault(parent, None)
+        self._parents[frame] = parent
+        self._poses[frame] = pose
+        self._cache.clear(counts = False)
+
+    def add_static(self, frame, parent, x, y, head):
+        """Add a frame with a fixed pose in its parent
+        frame: name of the new frame
+        parent: name of the parent frame, which is added as a root if it is new
+        x: x position of the frame's origin in the parent
+        y: y position of the frame's origin in the parent
+        head: heading of the frame in the parent, in radians
+        """
+        matrix = pose_2_matrix(x, y, head)
+        self._add(frame, parent, lambda t: matrix)
+
+    def add_dynamic(self, frame, parent, table):
+        """Add a frame whose pose in its parent changes over time
+        frame: name of the new frame
+        parent: name of the parent frame, which is added as a root if it is new
+        table: a pandas dataframe with columns 'Time', 'x', 'y' and 'head', with head in radians
+        """
+        track = _PoseTrack(table, ('x', 'y', 'head'), (None, None, 2*math.pi))
+        self._add(frame, parent, lambda t: pose_2_matrix(*track(t)))
+
+    def add_geodetic(self, frame, parent, table, origin_lat, origin_lon, origin_head = 0.0):
+        """Add a frame whose latitude, longitude and heading change over time
+        frame: name of the new frame
+        parent: name of the parent frame, whose origin is at the given latitude, longitude and heading
+        table: a pandas dataframe with columns 'Time', 'lat', 'lon' and 'head', with head in radians
+        origin_lat: latitude of the parent's origin
+        origin_lon: longitude of the parent's origin
+        origin_head: heading of the parent's origin
+        The pose is found with latlon_transform_m_2d_batch after interpolating the table.
+        """
+        track = _PoseTrack(table, ('lat', 'lon', 'head'), (None, None, 2*math.pi))
+        def pose(t):
+            lat, lon, head = track(t)
+            return latlon_transform_m_2d_batch(
+                [lat], [lon], [head], [origin_lat], [origin_lon], [origin_head], dtype = tf.float64
+            )[0].numpy()
+        self._add(frame, parent, pose)
+
+    @property
+    def maxsize(self):
+        """Most composed transforms the cache keeps"""
+        return self._cache.maxsize
+
+    @property
+    def hits(self):
+        """Lookups answered from the cache"""
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        """Lookups that composed a new transform"""
+        return self._cache.misses
+
+    @property
+    def frames(self):
+        """Names of all the frames in the tree"""
+        return list(self._parents)
+
+    def _path_to_root(self, frame):
+        if frame not in self._parents:
+            raise ValueError(f"unknown frame {frame}")
+        path = [frame]
+        while self._parents[path[-1]] is not None:
+            path.append(self._parents[path[-1]])
+        return path
+
+    def _compose(self, path, t):
+        """Transform from the first frame of a path to the parent of its last frame"""
+        matrix = np.eye(3)
+        for frame in path:
+            matrix = self._poses[frame](t) @ matrix
+        return matrix
+
+    def lookup(self, target, source, t = None, dtype = tf.float32):
+        """Get the transform from one frame to another at a time
+        target: name of the frame to transform into
+        source: name of the frame to transform from
+        t: time to interpolate the poses at, only needed if a frame on the path moves
+        dtype: dtype of the result
+        Returns a (3,3) tensor that maps homogenous coordinates in source to coordinates in target.
+        """
+        source_path = self._path_to_root(source)
+        target_path = self._path_to_root(target)
+        if source_path[-1] != target_path[-1]:
+            raise ValueError(f"frames {source} and {target} are not connected")
+        # drop the shared part of the paths, leaving each side's frames below the common ancestor
+        while len(source_path) and len(target_path) and source_path[-1] == target_path[-1]:
+            source_path.pop()
+            target_path.pop()
+
+        bucket = None if t is None else round(float(t)/self.time_quantum)
+        matrix = self._cache.get(
+            (target, source, bucket),
+            lambda: np.linalg.inv(self._compose(target_path, t)) @ self._compose(source_path, t)
+        )
+        return tf.constant(matrix, dtype)
+
+    def transform_points(self, target, source, points, t = None):
+        """Transform homogenous coordinates from one frame to another
+        target: name of the frame to transform into
+        source: name of the frame to transform from
+        points: homogenous float32 coordinates in source, shape (N,3)
+        t: time to interpolate the poses at
+        """
+        points = tf.convert_to_tensor(points)
+        transform = self.lookup(target, source, t, dtype = points.dtype)
+        return _normalise_homogenous_tf(points @ tf.transpose(transform))
+
+    def clear_cache(self):
+        """Drop all cached transforms and reset the counters"""
+        self._cache.clear()
+
+    def info(self):
+        """Get the hit and miss counts and the current cache size, as a dict"""
+        return self._cache.info()
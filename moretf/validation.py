@@ -0,0 +1,79 @@
+import os
+import contextlib
+import threading
+
+# Control how much runtime checking moretf does
+# 'full' runs every check on every call (the default, and what the tests use)
+# 'sampled' runs the checks on every Nth call of each function
+# 'off' skips the checks entirely
+# The level can also be set with the MORETF_VALIDATION and MORETF_VALIDATION_EVERY environment variables.
+# Inside a tf.function the decision is made when the function is traced, not on every call.
+# checks_skipped turns the checks off for one thread without touching the level or the sampling counts.
+
+LEVELS = ('off', 'sampled', 'full')
+
+_level = 'full'
+_every = 100
+_counts = {}
+_local = threading.local()
+
+def set_validation_level(level, every = None):
+    """Set how much runtime checking to do
+    level: one of 'off', 'sampled' or 'full'
+    every: in 'sampled' mode, check one call in this many
+    """
+    global _level, _every
+    if level not in LEVELS:
+        raise ValueError(f"validation level must be one of {LEVELS} (value was {level})")
+    if every is not None:
+        if every < 1:
+            raise ValueError(f"every must be at least 1 (value was {every})")
+        _every = int(every)
+    _level = level
+    _counts.clear()
+
+def get_validation_level():
+    """Get the current validation level"""
+    return _level
+
+@contextlib.contextmanager
+def validation_level(level, every = None):
+    """Temporarily set the validation level
+    level: one of 'off', 'sampled' or 'full'
+    every: in 'sampled' mode, check one call in this many
+    """
+    previous = (_level, _every)
+    set_validation_level(level, every)
+    try:
+        yield
+    finally:
+        set_validation_level(*previous)
+
+@contextlib.contextmanager
+def checks_skipped():
+    """Skip the checks in this thread only, leaving the level and the sampling counts alone"""
+    previous = getattr(_local, 'skipped', False)
+    _local.skipped = True
+    try:
+        yield
+    finally:
+        _local.skipped = previous
+
+def should_validate(name):
+    """Decide whether a call should run its checks
+    name: the name of the function being checked, so each function is sampled separately
+    """
+    if getattr(_local, 'skipped', False):
+        return False
+    if _level == 'full':
+        return True
+    if _level == 'off':
+        return False
+    count = _counts.get(name, 0)
+    _counts[name] = count + 1
+    return count % _every == 0
+
+set_validation_level(
+    os.environ.get('MORETF_VALIDATION', 'full'),
+    int(os.environ.get('MORETF_VALIDATION_EVERY', _every))
+)